@@ -0,0 +1,136 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import typer
+
+import server
+
+cli = typer.Typer(help="WOIYA Marketplace maintenance commands")
+
+@cli.callback()
+def main():
+    pass
+
+@cli.command()
+def migrate_message_buckets(batch_size: int = 1000):
+    """Copy existing per-message documents into conversation buckets (re-runnable until storage is switched)."""
+    result = asyncio.run(server.migrate_messages_to_buckets(batch_size=batch_size))
+    typer.echo(f"Migrated {result['messages_migrated']} messages into {result['buckets_written']} buckets")
+
+@cli.command()
+def dedupe_bids():
+    """Remove duplicate bids by one provider on one job so the unique bid index can be built.
+
+    Run this before deploying the unique (job_id, bidder_id) index, then restart the server.
+    """
+    removed = asyncio.run(server.dedupe_bids())
+    typer.echo(f"Removed {removed} duplicate bids")
+
+@cli.command()
+def grant_admin(email: str, revoke: bool = False):
+    """Grant (or with --revoke, remove) admin access for the user with this email."""
+    if not asyncio.run(server.set_admin(email, not revoke)):
+        typer.echo(f"No user with email {email}", err=True)
+        raise typer.Exit(code=1)
+    typer.echo(f"{'Revoked' if revoke else 'Granted'} admin access for {email}")
+
+@cli.command()
+def backfill_conversations(batch_size: int = 1000):
+    """Build inbox summaries and unread counts from the stored messages."""
+    written = asyncio.run(server.backfill_conversations(batch_size=batch_size))
+    typer.echo(f"Wrote {written} conversation summaries")
+
+@cli.command()
+def backfill_rollups():
+    """Rebuild the daily marketplace rollups from jobs, bids and payments."""
+    buckets = asyncio.run(server.backfill_rollups())
+    typer.echo(f"Wrote {buckets} day/category rollup buckets")
+
+@cli.command()
+def sweep_expired_jobs(batch_size: int = server.JOB_EXPIRY_BATCH_SIZE):
+    """Close open jobs whose deadline has passed."""
+    closed = asyncio.run(server.sweep_expired_jobs(batch_size=batch_size))
+    typer.echo(f"Closed {closed} expired jobs")
+
+@cli.command()
+def rebuild_leaderboards(batch_size: int = 1000):
+    """Recompute provider leaderboard scores from all ratings."""
+    entries = asyncio.run(server.rebuild_leaderboards(batch_size=batch_size))
+    typer.echo(f"Wrote {entries} leaderboard entries")
+
+@cli.command()
+def rebuild_price_sketches(batch_size: int = 1000):
+    """Recompute bid price guidance sketches from all bids."""
+    sketches = asyncio.run(server.rebuild_bid_price_sketches(batch_size=batch_size))
+    typer.echo(f"Wrote {sketches} price sketches")
+
+@cli.command()
+def archive_closed_jobs(
+    older_than_days: int = server.ARCHIVE_AFTER_DAYS,
+    batch_size: int = server.ARCHIVE_BATCH_SIZE
+):
+    """Move closed jobs, their bids and settled payments to the archive collections."""
+    report = asyncio.run(server.archive_closed_jobs(older_than_days=older_than_days, batch_size=batch_size))
+    typer.echo(f"Archived records closed before {report['cutoff']:%Y-%m-%d}")
+    for collection, count in report["moved"].items():
+        reclaimed = report["reclaimed"].get(collection)
+        detail = f" ({reclaimed['bytes']} bytes, {reclaimed['index_bytes']} index bytes reclaimed)" if reclaimed else ""
+        typer.echo(f"  {collection}: {count} moved{detail}")
+
+async def run_storage_benchmark(operations: int) -> dict:
+    # Exercises the storage layer directly, so its cost can be told apart from HTTP and handler overhead
+    db = server.db
+    await server.create_indexes()
+    timings = {name: [] for name in ("insert_job", "feed_query", "insert_bid", "count_bids", "job_by_id")}
+    job_ids = []
+    
+    async def timed(name, operation):
+        started = time.perf_counter()
+        await operation
+        timings[name].append(time.perf_counter() - started)
+    
+    for i in range(operations):
+        job_id = str(uuid.uuid4())
+        job_ids.append(job_id)
+        await timed("insert_job", db.jobs.insert_one({
+            "id": job_id, "title": f"Benchmark job {i}", "category": server.JobCategory.COURIER,
+            "status": server.JobStatus.OPEN, "creator_id": "benchmark-seeker", "budget_min": 10000,
+            "budget_max": 50000, "deadline": datetime.utcnow() + timedelta(days=1),
+            "created_at": datetime.utcnow(), "bids_count": 0
+        }))
+        await timed("insert_bid", db.bids.insert_one({
+            "id": str(uuid.uuid4()), "job_id": job_id, "bidder_id": f"benchmark-provider-{i}",
+            "amount": 25000, "created_at": datetime.utcnow()
+        }))
+    
+    for i in range(operations):
+        job_id = job_ids[i]
+        await timed("feed_query", db.jobs.find({"status": server.JobStatus.OPEN}, {"_id": 0}).sort("created_at", -1).limit(20).to_list(length=None))
+        await timed("count_bids", db.bids.count_documents({"job_id": job_id}))
+        await timed("job_by_id", db.jobs.find_one({"id": job_id}, {"_id": 0}))
+    
+    await db.bids.delete_many({"bidder_id": {"$in": [f"benchmark-provider-{i}" for i in range(operations)]}})
+    await db.jobs.delete_many({"creator_id": "benchmark-seeker"})
+    
+    report = {}
+    for name, samples in timings.items():
+        samples.sort()
+        report[name] = {
+            "ops_per_second": len(samples) / sum(samples) if sum(samples) else 0.0,
+            "p50_ms": samples[len(samples) // 2] * 1000,
+            "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+        }
+    return report
+
+@cli.command()
+def benchmark_storage(operations: int = 1000):
+    """Time core reads and writes against the configured STORAGE_BACKEND."""
+    report = asyncio.run(run_storage_benchmark(operations))
+    typer.echo(f"Storage backend: {server.STORAGE_BACKEND}")
+    for name, stats in report.items():
+        typer.echo(f"{name:12} {stats['ops_per_second']:10.0f} ops/s  p50 {stats['p50_ms']:.3f} ms  p99 {stats['p99_ms']:.3f} ms")
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,753 @@
+# In-memory storage backend exposing the subset of the Motor collection API used by server.py.
+# Selected with STORAGE_BACKEND=memory so the API suite and benchmarks run without MongoDB.
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from bson import ObjectId, decode, encode
+from pymongo import InsertOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import itertools
+import math
+import re
+import time
+
+_MISSING = object()
+
+# Documents and query values are round-tripped through BSON, exactly like a real server would:
+# enums become strings, timezone-aware datetimes become naive UTC, and callers get private copies
+def normalize(value: Any) -> Any:
+    return decode(encode({"v": value}))["v"]
+
+def copy_doc(doc: dict) -> dict:
+    return decode(encode(doc))
+
+# Query matching
+def resolve_path(value: Any, parts: List[str]) -> List[Any]:
+    if not parts:
+        return [value]
+    if isinstance(value, list):
+        if parts[0].isdigit():
+            index = int(parts[0])
+            return resolve_path(value[index], parts[1:]) if index < len(value) else []
+        results = []
+        for item in value:
+            results.extend(resolve_path(item, parts))
+        return results
+    if isinstance(value, dict) and parts[0] in value:
+        return resolve_path(value[parts[0]], parts[1:])
+    return []
+
+def candidate_values(doc: dict, path: str) -> List[Any]:
+    # Array fields match on the array itself and on each element, as in MongoDB
+    values = []
+    for value in resolve_path(doc, path.split(".")):
+        values.append(value)
+        if isinstance(value, list):
+            values.extend(value)
+    return values
+
+def compare(op: Callable[[Any, Any], bool], left: Any, right: Any) -> bool:
+    try:
+        return op(left, right)
+    except TypeError:
+        return False
+
+COMPARISONS = {
+    "$gt": lambda a, b: a > b,
+    "$gte": lambda a, b: a >= b,
+    "$lt": lambda a, b: a < b,
+    "$lte": lambda a, b: a <= b
+}
+
+def values_equal(values: List[Any], expected: Any) -> bool:
+    if expected is None and not values:
+        return True
+    return any(value == expected for value in values)
+
+def match_condition(values: List[Any], condition: Any) -> bool:
+    if not (isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition)):
+        return values_equal(values, condition)
+
+    for op, operand in condition.items():
+        if op == "$eq":
+            matched = values_equal(values, operand)
+        elif op == "$ne":
+            matched = not values_equal(values, operand)
+        elif op == "$in":
+            matched = any(values_equal(values, option) for option in operand)
+        elif op == "$nin":
+            matched = not any(values_equal(values, option) for option in operand)
+        elif op == "$exists":
+            matched = bool(values) == bool(operand)
+        elif op in COMPARISONS:
+            matched = any(compare(COMPARISONS[op], value, operand) for value in values)
+        elif op == "$regex":
+            matched = any(isinstance(value, str) and re.search(operand, value) for value in values)
+        elif op == "$elemMatch":
+            matched = any(isinstance(value, dict) and matches(value, operand) for value in values)
+        else:
+            raise NotImplementedError(f"Query operator {op} is not supported by the in-memory backend")
+        if not matched:
+            return False
+    return True
+
+def matches(doc: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, sub_query) for sub_query in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub_query) for sub_query in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, sub_query) for sub_query in condition):
+                return False
+        elif not match_condition(candidate_values(doc, key), condition):
+            return False
+    return True
+
+# Sorting follows MongoDB's type bracketing so mixed/missing values order the same way
+def sort_bracket(value: Any) -> Tuple[int, Any]:
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (5, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (6, value)
+    return (3, str(value))
+
+def sort_docs(docs: List[dict], sort_spec: List[Tuple[str, int]]) -> List[dict]:
+    for field, direction in reversed(sort_spec):
+        def key(doc, field=field):
+            values = resolve_path(doc, field.split("."))
+            return sort_bracket(values[0] if values else _MISSING)
+        docs.sort(key=key, reverse=direction < 0)
+    return docs
+
+def apply_projection(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return doc
+    include_id = bool(projection.get("_id", 1))
+    included = [field for field, flag in projection.items() if field != "_id" and flag]
+    if included:
+        result = {field: doc[field] for field in included if field in doc}
+        if include_id and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    excluded = {field for field, flag in projection.items() if not flag}
+    return {field: value for field, value in doc.items() if field not in excluded}
+
+# Updates
+ARRAY_FILTER = re.compile(r"^\$\[(\w+)\]$")
+
+def set_path(target: Any, parts: List[str], operation: Callable[[Any], Any], array_filters: Dict[str, dict]):
+    head, rest = parts[0], parts[1:]
+    filtered = ARRAY_FILTER.match(head)
+    if filtered or head == "$[]":
+        if not isinstance(target, list):
+            return
+        element_filter = array_filters.get(filtered.group(1)) if filtered else None
+        for index, element in enumerate(target):
+            if element_filter is None or matches({"e": element}, element_filter):
+                if rest:
+                    set_path(element, rest, operation, array_filters)
+                else:
+                    target[index] = operation(element)
+        return
+
+    if isinstance(target, list):
+        index = int(head)
+        if rest:
+            set_path(target[index], rest, operation, array_filters)
+        else:
+            target[index] = operation(target[index])
+        return
+
+    if rest:
+        set_path(target.setdefault(head, {}), rest, operation, array_filters)
+    else:
+        result = operation(target.get(head, _MISSING))
+        if result is _MISSING:
+            target.pop(head, None)
+        else:
+            target[head] = result
+
+def expand_positional(target: Any, parts: List[str], array_filters: Dict[str, dict]) -> List[List[str]]:
+    # Resolves "$[]" and "$[name]" segments to concrete indexes against the document as it was before
+    # the update, so one field's change never affects which elements another field's filter selects
+    for position, head in enumerate(parts):
+        filtered = ARRAY_FILTER.match(head)
+        if filtered or head == "$[]":
+            if not isinstance(target, list):
+                return []
+            element_filter = array_filters.get(filtered.group(1)) if filtered else None
+            return [
+                parts[:position] + [str(index)] + expanded
+                for index, element in enumerate(target)
+                if element_filter is None or matches({"e": element}, element_filter)
+                for expanded in expand_positional(element, parts[position + 1:], array_filters)
+            ]
+        if isinstance(target, list) and head.isdigit() and int(head) < len(target):
+            target = target[int(head)]
+        elif isinstance(target, dict) and head in target:
+            target = target[head]
+        else:
+            break
+    return [parts]
+
+def inc_value(amount):
+    return lambda current: amount if current is _MISSING else current + amount
+
+def push_value(value):
+    items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+    return lambda current: ([] if current is _MISSING else current) + list(items)
+
+def bound_value(value, keep):
+    return lambda current: value if current is _MISSING or keep(value, current) else current
+
+def apply_update(doc: dict, update: Any, array_filters: Optional[List[dict]] = None, inserting: bool = False):
+    if isinstance(update, list):
+        apply_pipeline_update(doc, update)
+        return
+
+    # Array filters are written against the placeholder name ("m.sender_id"); match them on {"e": element}
+    filters: Dict[str, dict] = {}
+    for array_filter in array_filters or []:
+        for key, condition in array_filter.items():
+            name, _, field = key.partition(".")
+            filters.setdefault(name, {})[f"e.{field}" if field else "e"] = condition
+
+    operations = []
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            if op in ("$set", "$setOnInsert"):
+                operation = lambda current, value=value: value
+            elif op == "$unset":
+                operation = lambda current: _MISSING
+            elif op == "$inc":
+                operation = inc_value(value)
+            elif op == "$push":
+                operation = push_value(value)
+            elif op == "$min":
+                operation = bound_value(value, lambda new, current: new < current)
+            elif op == "$max":
+                operation = bound_value(value, lambda new, current: new > current)
+            else:
+                raise NotImplementedError(f"Update operator {op} is not supported by the in-memory backend")
+            operations.extend((parts, operation) for parts in expand_positional(doc, path.split("."), filters))
+    for parts, operation in operations:
+        set_path(doc, parts, operation, filters)
+
+def apply_pipeline_update(doc: dict, pipeline: List[dict]):
+    # Update pipelines: each stage sees the document as left by the previous one
+    for stage in pipeline:
+        (op, spec), = stage.items()
+        if op in ("$set", "$addFields"):
+            values = {path: evaluate(expression, doc) for path, expression in spec.items()}
+            for path, value in values.items():
+                set_path(doc, path.split("."), lambda current, value=value: value, {})
+        elif op == "$unset":
+            for path in [spec] if isinstance(spec, str) else spec:
+                set_path(doc, path.split("."), lambda current: _MISSING, {})
+        else:
+            raise NotImplementedError(f"Update pipeline stage {op} is not supported by the in-memory backend")
+
+def upsert_seed(query: dict) -> dict:
+    seed: Dict[str, Any] = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                set_path(seed, key.split("."), lambda current, v=condition["$eq"]: v, {})
+            continue
+        set_path(seed, key.split("."), lambda current, v=condition: v, {})
+    return seed
+
+# Aggregation: the stages and accumulators the server's pipelines use, evaluated over plain lists
+EXPRESSION_OPERATORS: Dict[str, Callable[..., Any]] = {
+    "$add": lambda *values: sum(values),
+    "$subtract": lambda left, right: (
+        (left - right).total_seconds() * 1000 if isinstance(left, datetime) and isinstance(right, datetime) else left - right
+    ),
+    "$multiply": lambda *values: math.prod(values),
+    "$divide": lambda left, right: left / right,
+    "$ifNull": lambda value, replacement: replacement if value is None else value,
+    "$max": lambda *values: max(value for value in values if value is not None),
+    "$min": lambda *values: min(value for value in values if value is not None),
+    "$round": lambda value, places=0: round(value, places)
+}
+
+def evaluate(expression: Any, doc: dict) -> Any:
+    if isinstance(expression, str) and expression.startswith("$"):
+        values = resolve_path(doc, expression[1:].split("."))
+        return values[0] if values else None
+    if isinstance(expression, dict) and expression and not any(key.startswith("$") for key in expression):
+        return {key: evaluate(value, doc) for key, value in expression.items()}
+    if isinstance(expression, dict) and len(expression) == 1:
+        (op, arguments), = expression.items()
+        if op == "$literal":
+            return arguments
+        if op == "$dateToString":
+            date = evaluate(arguments["date"], doc)
+            return date.strftime(arguments["format"]) if date is not None else None
+        if op in EXPRESSION_OPERATORS:
+            arguments = arguments if isinstance(arguments, list) else [arguments]
+            return EXPRESSION_OPERATORS[op](*[evaluate(argument, doc) for argument in arguments])
+    if isinstance(expression, dict):
+        raise NotImplementedError(f"Expression {expression} is not supported by the in-memory backend")
+    return expression
+
+def accumulate(spec: Dict[str, dict], docs: List[dict]) -> dict:
+    result = {}
+    for field, accumulator in spec.items():
+        (op, expression), = accumulator.items()
+        values = [evaluate(expression, doc) for doc in docs]
+        numbers = [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        present = [value for value in values if value is not None]
+        if op == "$sum":
+            result[field] = sum(numbers)
+        elif op == "$avg":
+            result[field] = sum(numbers) / len(numbers) if numbers else None
+        elif op == "$min":
+            result[field] = min(present, key=sort_bracket) if present else None
+        elif op == "$max":
+            result[field] = max(present, key=sort_bracket) if present else None
+        elif op == "$first":
+            result[field] = values[0] if values else None
+        elif op == "$push":
+            result[field] = values
+        else:
+            raise NotImplementedError(f"Accumulator {op} is not supported by the in-memory backend")
+    return result
+
+def group_docs(docs: List[dict], key_of: Callable[[dict], Any], accumulators: Dict[str, dict]) -> List[dict]:
+    groups: Dict[bytes, Tuple[Any, List[dict]]] = {}
+    for doc in docs:
+        key = key_of(doc)
+        groups.setdefault(encode({"v": key}), (key, []))[1].append(doc)
+    return [{"_id": key, **accumulate(accumulators, members)} for key, members in groups.values()]
+
+def bucket_key(value: Any, boundaries: List[Any], default: Any) -> Any:
+    for lower, upper in zip(boundaries, boundaries[1:]):
+        if compare(lambda a, b: a >= b, value, lower) and compare(lambda a, b: a < b, value, upper):
+            return lower
+    return default
+
+def run_pipeline(docs: List[dict], pipeline: List[dict], database: Optional["InMemoryDatabase"] = None) -> List[dict]:
+    for stage in pipeline:
+        (op, spec), = stage.items()
+        if op == "$match":
+            query = normalize(spec)
+            docs = [doc for doc in docs if matches(doc, query)]
+        elif op == "$group":
+            accumulators = {field: value for field, value in spec.items() if field != "_id"}
+            docs = group_docs(docs, lambda doc: evaluate(spec["_id"], doc), accumulators)
+        elif op == "$bucket":
+            boundaries = normalize(spec["boundaries"])
+            output = spec.get("output", {"count": {"$sum": 1}})
+            docs = group_docs(
+                docs, lambda doc: bucket_key(evaluate(spec["groupBy"], doc), boundaries, spec.get("default")), output
+            )
+            docs = sort_docs(docs, [("_id", 1)])
+        elif op == "$facet":
+            docs = [{name: run_pipeline(list(docs), sub_pipeline, database) for name, sub_pipeline in spec.items()}]
+        elif op == "$lookup":
+            foreign = database[spec["from"]]
+            docs = [
+                {**doc, spec["as"]: [
+                    copy_doc(match) for match in foreign._matching({spec["foreignField"]: evaluate(f"${spec['localField']}", doc)})
+                ]}
+                for doc in docs
+            ]
+        elif op == "$unwind":
+            # Top-level array fields only; documents whose array is missing or empty are dropped
+            field = spec[1:]
+            docs = [{**doc, field: element} for doc in docs for element in doc.get(field) or []]
+        elif op == "$sort":
+            docs = sort_docs(list(docs), list(spec.items()))
+        elif op == "$skip":
+            docs = docs[spec:]
+        elif op == "$limit":
+            docs = docs[:spec]
+        elif op == "$count":
+            docs = [{spec: len(docs)}] if docs else []
+        else:
+            raise NotImplementedError(f"Aggregation stage {op} is not supported by the in-memory backend")
+    return docs
+
+class InMemoryIndex:
+    def __init__(self, keys: List[Tuple[str, int]], unique: bool, expire_after: Optional[float]):
+        self.fields = [field for field, _ in keys]
+        self.unique = unique
+        self.expire_after = expire_after
+        self.entries: Dict[Any, set] = {}  # leading field value -> document keys
+
+    def leading_values(self, doc: dict) -> List[Any]:
+        values = candidate_values(doc, self.fields[0]) or [None]
+        return [value for value in values if not isinstance(value, (dict, list))]
+
+    def unique_key(self, doc: dict) -> Tuple:
+        key = []
+        for field in self.fields:
+            values = resolve_path(doc, field.split("."))
+            key.append(encode({"v": values[0] if values else None}))
+        return tuple(key)
+
+    def add(self, doc_key: Any, doc: dict):
+        for value in self.leading_values(doc):
+            self.entries.setdefault(value, set()).add(doc_key)
+
+    def remove(self, doc_key: Any, doc: dict):
+        for value in self.leading_values(doc):
+            keys = self.entries.get(value)
+            if keys:
+                keys.discard(doc_key)
+                if not keys:
+                    del self.entries[value]
+
+class InMemoryCursor:
+    def __init__(self, collection: "InMemoryCollection", query: dict, projection: Optional[dict]):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction: Optional[int] = None):
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction if direction is not None else 1)]
+        else:
+            self._sort = list(key_or_list)
+        return self
+
+    def skip(self, skip: int):
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size: int):
+        return self
+
+    def _results(self) -> List[dict]:
+        docs = self.collection._matching(self.query)
+        if self._sort:
+            docs = sort_docs(docs, self._sort)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [apply_projection(copy_doc(doc), self.projection) for doc in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = self._results()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._results():
+            yield doc
+
+class InMemoryAggregateCursor:
+    def __init__(self, run: Callable[[], List[dict]]):
+        self._run = run
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = self._run()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._run():
+            yield doc
+
+class InMemoryCollection:
+    def __init__(self, name: str, database: Optional["InMemoryDatabase"] = None):
+        self.name = name
+        self.database = database
+        self._docs: Dict[Any, dict] = {}
+        self._positions: Dict[Any, int] = {}  # insertion order, used to keep index hits in natural order
+        self._counter = itertools.count()
+        self._indexes: Dict[str, InMemoryIndex] = {}
+        self._next_expiry_check = 0.0
+
+    # Indexes
+    async def create_index(self, keys, unique: bool = False, expireAfterSeconds: Optional[float] = None, name: Optional[str] = None, **kwargs) -> str:
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        if name not in self._indexes:
+            index = InMemoryIndex(keys, unique, expireAfterSeconds)
+            seen = set()
+            for doc_key, doc in self._docs.items():
+                if unique:
+                    key = index.unique_key(doc)
+                    if key in seen:
+                        raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}")
+                    seen.add(key)
+                index.add(doc_key, doc)
+            self._indexes[name] = index
+        return name
+
+    def _check_unique(self, doc: dict, ignore_key: Any = _MISSING):
+        if doc["_id"] in self._docs and doc["_id"] != ignore_key:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_", 11000)
+        for name, index in self._indexes.items():
+            if not index.unique:
+                continue
+            key = index.unique_key(doc)
+            leading = resolve_path(doc, index.fields[0].split("."))
+            for doc_key in self._candidates({index.fields[0]: leading[0] if leading else None}):
+                if doc_key != ignore_key and index.unique_key(self._docs[doc_key]) == key:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}", 11000)
+
+    def _add(self, doc: dict):
+        self._docs[doc["_id"]] = doc
+        self._positions[doc["_id"]] = next(self._counter)
+        for index in self._indexes.values():
+            index.add(doc["_id"], doc)
+
+    def _replace(self, doc_key: Any, doc: dict):
+        for index in self._indexes.values():
+            index.remove(doc_key, self._docs[doc_key])
+            index.add(doc_key, doc)
+        self._docs[doc_key] = doc
+
+    def _remove(self, doc_key: Any):
+        doc = self._docs.pop(doc_key)
+        del self._positions[doc_key]
+        for index in self._indexes.values():
+            index.remove(doc_key, doc)
+
+    def _expire(self):
+        # TTL indexes are enforced lazily, at most once a second, like MongoDB's background monitor
+        now = time.monotonic()
+        if now < self._next_expiry_check:
+            return
+        self._next_expiry_check = now + 1
+        for index in self._indexes.values():
+            if index.expire_after is None:
+                continue
+            cutoff = datetime.utcnow() - timedelta(seconds=index.expire_after)
+            expired = [
+                doc_key for doc_key, doc in self._docs.items()
+                if any(isinstance(v, datetime) and v < cutoff for v in resolve_path(doc, index.fields[0].split(".")))
+            ]
+            for doc_key in expired:
+                self._remove(doc_key)
+
+    def _candidates(self, query: dict) -> Iterable[Any]:
+        # Use a secondary index when the query pins its leading field, otherwise scan
+        for index in self._indexes.values():
+            condition = query.get(index.fields[0], _MISSING)
+            if condition is _MISSING:
+                continue
+            if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+                if set(condition) == {"$in"}:
+                    keys = set()
+                    for value in condition["$in"]:
+                        keys |= index.entries.get(value, set())
+                    return keys
+                if set(condition) == {"$eq"}:
+                    condition = condition["$eq"]
+                else:
+                    continue
+            if isinstance(condition, (dict, list)):
+                continue
+            return set(index.entries.get(condition, set()))
+        if "_id" in query and not isinstance(query["_id"], dict):
+            return [query["_id"]] if query["_id"] in self._docs else []
+        return list(self._docs)
+
+    def _matching(self, query: Optional[dict]) -> List[dict]:
+        self._expire()
+        query = normalize(query or {})
+        candidates = self._candidates(query)
+        if isinstance(candidates, set):
+            # Keep insertion order for index hits so unsorted reads behave like a scan
+            candidates = sorted((k for k in candidates if k in self._positions), key=self._positions.__getitem__)
+        return [self._docs[doc_key] for doc_key in candidates if doc_key in self._docs and matches(self._docs[doc_key], query)]
+
+    # Reads
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, **kwargs) -> InMemoryCursor:
+        return InMemoryCursor(self, filter or {}, projection)
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None, **kwargs) -> Optional[dict]:
+        docs = self._matching(filter)
+        return apply_projection(copy_doc(docs[0]), projection) if docs else None
+
+    async def count_documents(self, filter: dict, limit: int = 0, skip: int = 0, **kwargs) -> int:
+        count = max(0, len(self._matching(filter)) - skip)
+        return min(count, limit) if limit else count
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        return len(self._docs)
+
+    async def distinct(self, key: str, filter: Optional[dict] = None, **kwargs) -> List[Any]:
+        values = []
+        for doc in self._matching(filter):
+            for value in candidate_values(doc, key):
+                if not isinstance(value, list) and value not in values:
+                    values.append(value)
+        return values
+
+    def aggregate(self, pipeline: List[dict], **kwargs) -> "InMemoryAggregateCursor":
+        # A leading $match can use the same index selection as find()
+        query = pipeline[0]["$match"] if pipeline and "$match" in pipeline[0] else {}
+        docs = [copy_doc(doc) for doc in self._matching(query)]
+        return InMemoryAggregateCursor(lambda: run_pipeline(docs, pipeline[1:] if query else pipeline, self.database))
+
+    # Writes
+    def _insert(self, document: dict) -> Any:
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        doc = copy_doc(document)
+        self._check_unique(doc)
+        self._add(doc)
+        return doc["_id"]
+
+    async def insert_one(self, document: dict, **kwargs):
+        return SimpleNamespace(inserted_id=self._insert(document), acknowledged=True)
+
+    async def insert_many(self, documents: Iterable[dict], ordered: bool = True, **kwargs):
+        inserted_ids, write_errors = [], []
+        for index, document in enumerate(documents):
+            try:
+                inserted_ids.append(self._insert(document))
+            except DuplicateKeyError as e:
+                write_errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": document})
+                if ordered:
+                    break
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors, "nInserted": len(inserted_ids)})
+        return SimpleNamespace(inserted_ids=inserted_ids, acknowledged=True)
+
+    def _update(self, filter: dict, update: dict, upsert: bool, multi: bool, array_filters: Optional[List[dict]]) -> Tuple[SimpleNamespace, Optional[dict], Optional[dict]]:
+        update = normalize(update)
+        targets = self._matching(filter)
+        if not multi:
+            targets = targets[:1]
+
+        matched = modified = 0
+        before = after = None
+        for doc in targets:
+            updated = copy_doc(doc)
+            apply_update(updated, update, array_filters)
+            matched += 1
+            if before is None:
+                before, after = copy_doc(doc), updated
+            if encode(updated) == encode(doc):
+                continue
+            self._check_unique(updated, ignore_key=doc["_id"])
+            self._replace(doc["_id"], updated)
+            modified += 1
+
+        upserted_id = None
+        if not targets and upsert:
+            doc = upsert_seed(normalize(filter))
+            apply_update(doc, update, array_filters, inserting=True)
+            upserted_id = self._insert(doc)
+            after = copy_doc(self._docs[upserted_id])
+
+        result = SimpleNamespace(matched_count=matched, modified_count=modified, upserted_id=upserted_id, acknowledged=True)
+        return result, before, after
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False, array_filters: Optional[List[dict]] = None, **kwargs):
+        return self._update(filter, update, upsert, False, array_filters)[0]
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False, array_filters: Optional[List[dict]] = None, **kwargs):
+        return self._update(filter, update, upsert, True, array_filters)[0]
+
+    async def find_one_and_update(self, filter: dict, update: dict, projection: Optional[dict] = None, upsert: bool = False, return_document: bool = ReturnDocument.BEFORE, array_filters: Optional[List[dict]] = None, sort=None, **kwargs) -> Optional[dict]:
+        if sort:
+            targets = sort_docs(self._matching(filter), sort)
+            if targets:
+                filter = {"_id": targets[0]["_id"]}
+        _, before, after = self._update(filter, update, upsert, False, array_filters)
+        doc = after if return_document == ReturnDocument.AFTER else before
+        return apply_projection(doc, projection) if doc else None
+
+    async def delete_one(self, filter: dict, **kwargs):
+        docs = self._matching(filter)[:1]
+        for doc in docs:
+            self._remove(doc["_id"])
+        return SimpleNamespace(deleted_count=len(docs), acknowledged=True)
+
+    async def delete_many(self, filter: dict, **kwargs):
+        docs = self._matching(filter)
+        for doc in docs:
+            self._remove(doc["_id"])
+        return SimpleNamespace(deleted_count=len(docs), acknowledged=True)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs):
+        # pymongo's request objects only expose their arguments as private attributes
+        matched = modified = inserted = deleted = 0
+        upserted_ids: Dict[int, Any] = {}
+        write_errors = []
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    inserted += 1
+                    continue
+                operation = type(request).__name__
+                if operation in ("DeleteOne", "DeleteMany"):
+                    delete = self.delete_one if operation == "DeleteOne" else self.delete_many
+                    deleted += (await delete(request._filter)).deleted_count
+                    continue
+                if operation == "ReplaceOne":
+                    raise NotImplementedError("ReplaceOne is not supported by the in-memory backend")
+                result, _, _ = self._update(
+                    request._filter, request._doc, bool(request._upsert),
+                    operation == "UpdateMany", request._array_filters
+                )
+                matched += result.matched_count
+                modified += result.modified_count
+                if result.upserted_id is not None:
+                    upserted_ids[index] = result.upserted_id
+            except DuplicateKeyError as e:
+                write_errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if write_errors:
+            raise BulkWriteError({
+                "writeErrors": write_errors, "nInserted": inserted, "nMatched": matched,
+                "nModified": modified, "nUpserted": len(upserted_ids), "nRemoved": deleted
+            })
+        return SimpleNamespace(
+            matched_count=matched, modified_count=modified, inserted_count=inserted,
+            deleted_count=deleted, upserted_count=len(upserted_ids), upserted_ids=upserted_ids, acknowledged=True
+        )
+
+class InMemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: Dict[str, InMemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> InMemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = InMemoryCollection(name, self)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> InMemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> InMemoryCollection:
+        return self[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return list(self._collections)
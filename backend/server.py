@@ -1,35 +1,436 @@
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Request, Header
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from starlette.middleware.exceptions import ExceptionMiddleware
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, AsyncIterator, Iterable, Tuple
+from datetime import datetime, timedelta, timezone
 from motor.motor_asyncio import AsyncIOMotorClient
+from memory_store import InMemoryDatabase
+from pymongo import ASCENDING, DESCENDING, UpdateMany, UpdateOne
+from pymongo.read_preferences import SecondaryPreferred
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from collections import defaultdict
 import os
+import logging
 import jwt
 import bcrypt
 import uuid
 from enum import Enum
+from contextvars import ContextVar
+from urllib.parse import urlencode, urlsplit
+from abc import ABC, abstractmethod
 import asyncio
+import heapq
+import itertools
+import time
+import codecs
+import hashlib
+import csv
+import io
+import json
+import math
+import re
+import numpy as np
 
-# Database connection
-client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
-db = client.woiya_marketplace
+logger = logging.getLogger(__name__)
+
+# Database connection: "mongo" (Motor) or "memory" (in-process, for tests and benchmarks).
+# Both expose the same collection API, so handlers never know which one they are talking to.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+if STORAGE_BACKEND == "memory":
+    client = None
+    db = InMemoryDatabase("woiya_marketplace")
+else:
+    client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    db = client.woiya_marketplace
+
+# Staleness-tolerant reads (provider feed, dashboards, wallet history) may be served by
+# secondaries; everything that must see the caller's own writes keeps using `db` (primary)
+READ_FROM_SECONDARIES = os.getenv("READ_FROM_SECONDARIES", "false").lower() == "true"
+READ_MAX_STALENESS_SECONDS = int(os.getenv("READ_MAX_STALENESS_SECONDS", "90"))  # MongoDB minimum is 90
+secondary_db = client.get_database(
+    db.name, read_preference=SecondaryPreferred(max_staleness=READ_MAX_STALENESS_SECONDS)
+) if READ_FROM_SECONDARIES and client is not None else db
 
 # Security
 security = HTTPBearer()
 JWT_SECRET = os.getenv("JWT_SECRET", "woiya-secret-key-2024")
 
+# Message storage: "documents" keeps one document per message, "buckets" groups
+# each conversation's messages into fixed-size time-bounded bucket documents
+MESSAGE_STORAGE = os.getenv("MESSAGE_STORAGE", "documents")
+MESSAGE_BUCKET_SIZE = int(os.getenv("MESSAGE_BUCKET_SIZE", "200"))
+
+# Write-behind batching for message inserts (document storage only)
+MESSAGE_WRITE_BATCHING = os.getenv("MESSAGE_WRITE_BATCHING", "false").lower() == "true"
+MESSAGE_WRITE_BATCH_SIZE = int(os.getenv("MESSAGE_WRITE_BATCH_SIZE", "100"))
+MESSAGE_WRITE_BATCH_DELAY_MS = float(os.getenv("MESSAGE_WRITE_BATCH_DELAY_MS", "5"))
+
+# Bulk job creation
+JOB_BULK_CHUNK_SIZE = int(os.getenv("JOB_BULK_CHUNK_SIZE", "500"))
+
+# Composite batch requests
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+
+# Admin exports
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_FIELDS = {
+    "jobs": [
+        "id", "title", "category", "status", "budget_min", "budget_max", "address", "deadline",
+        "creator_id", "bids_count", "selected_bid_id", "created_at", "selected_at", "completed_at"
+    ],
+    "bids": [
+        "id", "job_id", "bidder_id", "amount", "completion_time", "status", "is_selected", "created_at"
+    ],
+    "payments": [
+        "id", "job_id", "bid_id", "payer_id", "receiver_id", "amount", "payment_method", "status",
+        "gateway_payment_id", "created_at", "paid_at", "released_at"
+    ]
+}
+
+# Deadline expiry sweeper
+JOB_EXPIRY_SWEEP = os.getenv("JOB_EXPIRY_SWEEP", "true").lower() == "true"
+JOB_EXPIRY_SWEEP_INTERVAL = float(os.getenv("JOB_EXPIRY_SWEEP_INTERVAL", "300"))
+JOB_EXPIRY_BATCH_SIZE = int(os.getenv("JOB_EXPIRY_BATCH_SIZE", "1000"))
+JOB_EXPIRY_FILTER_AT_QUERY = os.getenv("JOB_EXPIRY_FILTER_AT_QUERY", "true").lower() == "true"
+
+# Idempotency keys for payment, bid and message creation
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+
+# Provider leaderboards: Bayesian average pulls providers with few ratings towards the prior mean
+LEADERBOARD_PRIOR_MEAN = float(os.getenv("LEADERBOARD_PRIOR_MEAN", "4.0"))
+LEADERBOARD_PRIOR_WEIGHT = float(os.getenv("LEADERBOARD_PRIOR_WEIGHT", "5"))
+LEADERBOARD_AREA_PRECISION = int(os.getenv("LEADERBOARD_AREA_PRECISION", "1"))  # decimal degrees, 1 = ~11 km cells
+
+# Assembled job detail responses are cached briefly; writes to a job invalidate it in this worker
+JOB_DETAIL_CACHE_TTL_SECONDS = float(os.getenv("JOB_DETAIL_CACHE_TTL_SECONDS", "5"))
+JOB_DETAIL_CACHE_SIZE = int(os.getenv("JOB_DETAIL_CACHE_SIZE", "5000"))
+
+# Job feed facets
+JOB_FACETS_CACHE_TTL_SECONDS = float(os.getenv("JOB_FACETS_CACHE_TTL_SECONDS", "30"))
+JOB_BUDGET_BUCKETS = [0, 50000, 100000, 250000, 500000, 1000000, 5000000]
+JOB_DEADLINE_BUCKETS = [("24h", timedelta(days=1)), ("3d", timedelta(days=3)), ("7d", timedelta(days=7)), ("30d", timedelta(days=30))]
+
+# Bid price guidance: log-bucketed sketches whose percentiles are within this relative error
+PRICE_SKETCH_RELATIVE_ACCURACY = float(os.getenv("PRICE_SKETCH_RELATIVE_ACCURACY", "0.02"))
+PRICE_GUIDANCE_MIN_SAMPLES = int(os.getenv("PRICE_GUIDANCE_MIN_SAMPLES", "5"))
+PRICE_GUIDANCE_PERCENTILES = (10, 25, 50, 75, 90)
+
+# Archival of closed jobs (with their bids and settled payments) to archive_* collections
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVED_COLLECTIONS = ("jobs", "bids", "payments")
+
+# Admission control: total concurrent request slots and, per priority class,
+# "<class>=<share of slots>:<max queued>:<max wait seconds>". Off by default; when enabling it, set
+# ADMISSION_CAPACITY from a load test of the deployment (the concurrency where p99 latency starts to climb).
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "false").lower() == "true"
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", "64"))
+ADMISSION_CLASSES = os.getenv("ADMISSION_CLASSES", "critical=1.0:128:5,standard=0.8:64:2,browse=0.6:64:0.5")
+
+# Rate limiting: "<class>=<requests>/<seconds>" token buckets per route class. Off by default; behind
+# an ingress set RATE_LIMIT_TRUSTED_PROXIES to the number of proxies that append to X-Forwarded-For,
+# otherwise every anonymous client shares the proxy's address and bucket.
+RATE_LIMITING = os.getenv("RATE_LIMITING", "false").lower() == "true"
+RATE_LIMITS = os.getenv("RATE_LIMITS", "auth=10/60,messages=60/60,feed=120/60,default=300/60")
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "0"))
+
 app = FastAPI(title="WOIYA Marketplace API", version="1.0.0")
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@app.on_event("startup")
+async def create_indexes():
+    # Every entity is looked up by its application-level id rather than _id
+    for collection in ("users", "jobs", "bids", "payments", "messages", "message_buckets", "ratings", "notifications"):
+        await db[collection].create_index([("id", ASCENDING)], unique=True)
+    await db.messages.create_index([("recipient_id", ASCENDING), ("sender_id", ASCENDING), ("is_read", ASCENDING)])
+    await db.conversations.create_index([("user_id", ASCENDING), ("partner_id", ASCENDING)], unique=True)
+    await db.conversations.create_index([("user_id", ASCENDING), ("last_message_at", DESCENDING)])
+    await db.message_buckets.create_index([("conversation_id", ASCENDING), ("start", ASCENDING)])
+    await db.message_buckets.create_index([("conversation_id", ASCENDING), ("end", ASCENDING)])
+    try:
+        await db.bids.create_index([("job_id", ASCENDING), ("bidder_id", ASCENDING)], unique=True)
+    except OperationFailure:
+        # Bids placed before the index existed may hold duplicates; keep serving until they are cleaned up
+        duplicates = await find_duplicate_bids()
+        logger.error(
+            "Unique (job_id, bidder_id) bid index not built, %d duplicated pairs such as %s. "
+            "Run `python manage.py dedupe-bids` and restart.",
+            len(duplicates), [(d["_id"]["job_id"], d["_id"]["bidder_id"]) for d in duplicates[:10]]
+        )
+    await db.notifications.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+    for collection in EXPORT_FIELDS:
+        await db[collection].create_index([("created_at", ASCENDING)])
+    await db.marketplace_rollups.create_index([("day", ASCENDING), ("category", ASCENDING)], unique=True)
+    await db.jobs.create_index([("status", ASCENDING), ("deadline", ASCENDING)])
+    await db.provider_scores.create_index(
+        [("provider_id", ASCENDING), ("category", ASCENDING), ("area", ASCENDING)], unique=True
+    )
+    await db.provider_scores.create_index([("category", ASCENDING), ("area", ASCENDING), ("score", DESCENDING)])
+    await db.bid_price_sketches.create_index(
+        [("category", ASCENDING), ("area", ASCENDING), ("kind", ASCENDING)], unique=True
+    )
+    for collection in ARCHIVED_COLLECTIONS:
+        await db[f"archive_{collection}"].create_index([("id", ASCENDING)], unique=True)
+    await db.archive_jobs.create_index([("creator_id", ASCENDING)])
+    await db.archive_bids.create_index([("job_id", ASCENDING)])
+    await db.archive_bids.create_index([("bidder_id", ASCENDING)])
+    await db.archive_payments.create_index([("payer_id", ASCENDING), ("created_at", DESCENDING)])
+    await db.archive_payments.create_index([("receiver_id", ASCENDING), ("created_at", DESCENDING)])
+    await db.idempotency_keys.create_index([("created_at", ASCENDING)], expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS)
+
+# In-process metrics
+class Metrics:
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.summaries: Dict[str, Dict[str, float]] = {}
+        self.gauges: Dict[str, float] = {}
+    
+    def set_gauge(self, name: str, value: float):
+        self.gauges[name] = value
+    
+    def inc(self, name: str, value: int = 1):
+        self.counters[name] += value
+    
+    def observe(self, name: str, value: float):
+        summary = self.summaries.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["max"] = max(summary["max"], value)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "summaries": {
+                name: {**summary, "avg": summary["sum"] / summary["count"] if summary["count"] else 0.0}
+                for name, summary in self.summaries.items()
+            }
+        }
+
+metrics = Metrics()
+
+# Admission control
+class AdmissionClass:
+    def __init__(self, name: str, priority: int, max_share: float, max_queue: int, max_wait: float):
+        self.name = name
+        self.priority = priority  # Lower values are admitted first
+        self.max_share = max_share
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+class AdmissionController:
+    # Shared pool of request slots. Lower-priority classes may only use part of the pool, queued
+    # requests are admitted highest priority first, and anything beyond a full queue is shed at once.
+    def __init__(self, capacity: int, classes: List[AdmissionClass]):
+        self.capacity = capacity
+        self.classes = {admission_class.name: admission_class for admission_class in classes}
+        self.inflight = 0
+        self.queued: Dict[str, int] = defaultdict(int)
+        self._waiters: List[tuple] = []  # heap of (priority, seq, class, future)
+        self._seq = itertools.count()
+    
+    def _has_room(self, admission_class: AdmissionClass) -> bool:
+        return self.inflight < max(1, int(self.capacity * admission_class.max_share))
+    
+    def _publish(self, admission_class: AdmissionClass):
+        metrics.set_gauge("admission_inflight", self.inflight)
+        metrics.set_gauge(f"admission_queue_depth.{admission_class.name}", self.queued[admission_class.name])
+    
+    async def acquire(self, name: str) -> bool:
+        admission_class = self.classes[name]
+        # Queued requests of equal or higher priority go first
+        queue_ahead = bool(self._waiters) and self._waiters[0][0] <= admission_class.priority and not self._waiters[0][3].done()
+        if self._has_room(admission_class) and not queue_ahead:
+            self.inflight += 1
+            self._publish(admission_class)
+            return True
+        
+        if self.queued[name] >= admission_class.max_queue:
+            metrics.inc("admission_shed")
+            metrics.inc(f"admission_shed.{name}")
+            return False
+        
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (admission_class.priority, next(self._seq), admission_class, future))
+        self.queued[name] += 1
+        self._publish(admission_class)
+        try:
+            await asyncio.wait_for(future, admission_class.max_wait)
+            return True
+        except asyncio.TimeoutError:
+            # The slot may have been handed over just as the wait expired
+            if future.done() and not future.cancelled():
+                return True
+            metrics.inc("admission_shed")
+            metrics.inc(f"admission_shed.{name}")
+            return False
+        finally:
+            self.queued[name] -= 1
+            self._publish(admission_class)
+    
+    def release(self, name: str):
+        self.inflight -= 1
+        while self._waiters:
+            _, _, admission_class, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._has_room(admission_class):
+                break
+            heapq.heappop(self._waiters)
+            self.inflight += 1
+            future.set_result(True)
+        self._publish(self.classes[name])
+
+def parse_admission_classes(spec: str) -> List[AdmissionClass]:
+    classes = []
+    for priority, entry in enumerate(filter(None, (part.strip() for part in spec.split(",")))):
+        name, _, rule = entry.partition("=")
+        max_share, max_queue, max_wait = rule.split(":")
+        classes.append(AdmissionClass(name.strip(), priority, float(max_share), int(max_queue), float(max_wait)))
+    return classes
+
+admission_controller = AdmissionController(ADMISSION_CAPACITY, parse_admission_classes(ADMISSION_CLASSES))
+
+def classify_admission(method: str, path: str) -> str:
+    if path.startswith("/api/auth/") or path.startswith("/api/payments/"):
+        return "critical"
+    if method == "GET":
+        return "browse"
+    return "standard"
+
+@app.middleware("http")
+async def admit_requests(request: Request, call_next):
+    if not ADMISSION_CONTROL or request.method == "OPTIONS" or not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    
+    admission_class = classify_admission(request.method, request.url.path)
+    if admission_class not in admission_controller.classes:
+        return await call_next(request)
+    
+    if not await admission_controller.acquire(admission_class):
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Server is busy, please retry"},
+            headers={"Retry-After": "1"}
+        )
+    try:
+        return await call_next(request)
+    finally:
+        admission_controller.release(admission_class)
+
+# Rate limiting
+class RateLimitBackend(ABC):
+    # Shared backends (e.g. Redis or MongoDB) implement the same call so limits hold across workers
+    @abstractmethod
+    async def acquire(self, key: str, capacity: float, refill_per_second: float) -> float:
+        # Returns 0 when a token was taken, otherwise the seconds until one becomes available
+        ...
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    def __init__(self, max_keys: int = 100000, idle_seconds: float = 3600):
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        self.buckets: Dict[str, List[float]] = {}  # key -> [tokens, last_refill]
+    
+    async def acquire(self, key: str, capacity: float, refill_per_second: float) -> float:
+        # No await between reading and writing a bucket, so the event loop makes this atomic without locks
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self._evict(now)
+            bucket = self.buckets[key] = [capacity, now]
+        
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_per_second)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        return (1 - tokens) / refill_per_second
+    
+    def _evict(self, now: float):
+        idle_keys = [key for key, (_, last) in self.buckets.items() if now - last > self.idle_seconds]
+        for key in idle_keys:
+            del self.buckets[key]
+        if len(self.buckets) >= self.max_keys:
+            # Everything is active: drop the oldest-created bucket rather than grow without bound
+            del self.buckets[next(iter(self.buckets))]
+
+def parse_rate_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        route_class, _, rule = entry.partition("=")
+        requests_allowed, _, seconds = rule.partition("/")
+        limits[route_class.strip()] = (float(requests_allowed), float(requests_allowed) / float(seconds))
+    return limits
+
+# (method, path pattern, route class, keyed by user when authenticated)
+RATE_LIMIT_ROUTES = [
+    ("POST", re.compile(r"^/api/auth/(login|register)$"), "auth", False),
+    ("POST", re.compile(r"^/api/messages$"), "messages", True),
+    ("GET", re.compile(r"^/api/jobs$"), "feed", True)
+]
+
+rate_limits = parse_rate_limits(RATE_LIMITS)
+rate_limit_backend: RateLimitBackend = InMemoryRateLimitBackend()
+
+def classify_rate_limit(method: str, path: str) -> Tuple[str, bool]:
+    for route_method, pattern, route_class, by_user in RATE_LIMIT_ROUTES:
+        if method == route_method and pattern.match(path):
+            return route_class, by_user
+    return "default", True
+
+def rate_limit_key(request: Request, by_user: bool) -> str:
+    if by_user:
+        # Only the token signature is checked here; the user lookup still happens in get_current_user
+        authorization = request.headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            try:
+                payload = jwt.decode(authorization[7:], JWT_SECRET, algorithms=["HS256"])
+                return f"user:{payload['user_id']}"
+            except (jwt.InvalidTokenError, KeyError):
+                pass
+    
+    # Each trusted proxy appends the address it received the request from, so the client is the
+    # entry that many hops from the right; anything further left is client-supplied and spoofable
+    if RATE_LIMIT_TRUSTED_PROXIES:
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(hops) >= RATE_LIMIT_TRUSTED_PROXIES:
+            return f"ip:{hops[-RATE_LIMIT_TRUSTED_PROXIES]}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+async def take_rate_limit_token(request: Request, method: str, path: str) -> Tuple[str, float]:
+    # Returns the route class and 0, or the seconds until its bucket has a token again
+    route_class, by_user = classify_rate_limit(method, path)
+    limit = rate_limits.get(route_class)
+    if not RATE_LIMITING or limit is None:
+        return route_class, 0.0
+    capacity, refill_per_second = limit
+    key = f"{route_class}:{rate_limit_key(request, by_user)}"
+    return route_class, await rate_limit_backend.acquire(key, capacity, refill_per_second)
+
+@app.middleware("http")
+async def rate_limit_requests(request: Request, call_next):
+    if not RATE_LIMITING or request.method == "OPTIONS" or not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    
+    route_class, retry_after = await take_rate_limit_token(request, request.method, request.url.path)
+    if retry_after > 0:
+        metrics.inc("rate_limit_rejected")
+        metrics.inc(f"rate_limit_rejected.{route_class}")
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Too many requests"},
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+    return await call_next(request)
 
 # Enums
 class UserRole(str, Enum):
@@ -50,6 +451,11 @@ class JobStatus(str, Enum):
     COMPLETED = "completed"
     CANCELLED = "cancelled"
 
+class BidStatus(str, Enum):
+    PENDING = "pending"
+    SELECTED = "selected"
+    REJECTED = "rejected"
+
 class PaymentMethod(str, Enum):
     GOPAY = "gopay"
     OVO = "ovo"
@@ -103,6 +509,14 @@ class MessageCreate(BaseModel):
     content: str
     job_id: Optional[str] = None
 
+class BatchSubRequest(BaseModel):
+    id: Optional[str] = None
+    path: str  # e.g. "/api/jobs"
+    params: Dict[str, Any] = {}
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest]
+
 class RatingCreate(BaseModel):
     target_user_id: str
     job_id: str
@@ -124,7 +538,13 @@ def create_jwt_token(user_id: str, role: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
+# Set while /api/batch runs its sub-requests so they reuse the already authenticated user
+batch_user: ContextVar[Optional[dict]] = ContextVar("batch_user", default=None)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    user = batch_user.get()
+    if user is not None:
+        return user
     try:
         payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=["HS256"])
         user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
@@ -136,6 +556,1231 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def conversation_summary_updates(message_doc: dict) -> List[UpdateOne]:
+    # One summary document per (user, partner) pair; the recipient's copy also counts unread messages
+    last_message = {
+        "id": message_doc["id"],
+        "sender_id": message_doc["sender_id"],
+        "content": message_doc["content"],
+        "job_id": message_doc["job_id"],
+        "created_at": message_doc["created_at"]
+    }
+    return [
+        UpdateOne(
+            {"user_id": message_doc["sender_id"], "partner_id": message_doc["recipient_id"]},
+            {
+                "$set": {"last_message": last_message, "last_message_at": message_doc["created_at"]},
+                "$setOnInsert": {"unread_count": 0}
+            },
+            upsert=True
+        ),
+        UpdateOne(
+            {"user_id": message_doc["recipient_id"], "partner_id": message_doc["sender_id"]},
+            {
+                "$set": {
+                    "last_message": last_message,
+                    "last_message_at": message_doc["created_at"],
+                    "partner_name": message_doc["sender_name"]
+                },
+                "$inc": {"unread_count": 1}
+            },
+            upsert=True
+        )
+    ]
+
+async def iter_stored_messages(batch_size: int = 1000) -> AsyncIterator[dict]:
+    if MESSAGE_STORAGE == "buckets":
+        async for bucket in db.message_buckets.find({}, {"_id": 0, "messages": 1}).batch_size(batch_size):
+            for message in bucket["messages"]:
+                yield message
+    else:
+        async for message in db.messages.find({}, {"_id": 0}).batch_size(batch_size):
+            yield message
+
+async def backfill_conversations(batch_size: int = 1000) -> int:
+    # Rebuilds every inbox summary from the stored messages; safe to re-run while messages keep arriving
+    summaries: Dict[Tuple[str, str], dict] = {}
+    async for message in iter_stored_messages(batch_size):
+        last_message = {
+            "id": message["id"],
+            "sender_id": message["sender_id"],
+            "content": message["content"],
+            "job_id": message.get("job_id"),
+            "created_at": message["created_at"]
+        }
+        for user_id, partner_id in ((message["sender_id"], message["recipient_id"]), (message["recipient_id"], message["sender_id"])):
+            summary = summaries.setdefault((user_id, partner_id), {"unread_count": 0, "last_message_at": None})
+            if user_id == message["recipient_id"]:
+                summary["partner_name"] = message.get("sender_name") or summary.get("partner_name")
+                if not message.get("is_read"):
+                    summary["unread_count"] += 1
+            if summary["last_message_at"] is None or message["created_at"] >= summary["last_message_at"]:
+                summary["last_message"] = last_message
+                summary["last_message_at"] = message["created_at"]
+    
+    # A summary that a live message has already moved past is left alone; re-running picks that message up
+    updates = [
+        UpdateOne(
+            {"user_id": user_id, "partner_id": partner_id, "last_message_at": {"$lte": summary["last_message_at"]}},
+            {"$set": {key: value for key, value in summary.items() if value is not None}},
+            upsert=True
+        )
+        for (user_id, partner_id), summary in summaries.items()
+    ]
+    written = 0
+    for start in range(0, len(updates), batch_size):
+        try:
+            result = await db.conversations.bulk_write(updates[start:start + batch_size], ordered=False)
+            written += result.modified_count + result.upserted_count
+        except BulkWriteError as e:
+            # Duplicate keys are summaries that already hold a newer message
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            written += e.details.get("nModified", 0) + e.details.get("nUpserted", 0)
+    return written
+
+def conversation_key(user_a: str, user_b: str) -> str:
+    return ":".join(sorted([user_a, user_b]))
+
+def new_message_bucket(conversation_id: str, messages: List[dict], bucket_id: Optional[str] = None) -> dict:
+    return {
+        "id": bucket_id or str(uuid.uuid4()),
+        "conversation_id": conversation_id,
+        "participants": conversation_id.split(":"),
+        "count": len(messages),
+        "start": messages[0]["created_at"],
+        "end": messages[-1]["created_at"],
+        "messages": messages
+    }
+
+async def append_to_message_bucket(message_doc: dict):
+    # Appends to the conversation's open bucket, or starts a new one once it is full
+    await db.message_buckets.update_one(
+        {
+            "conversation_id": conversation_key(message_doc["sender_id"], message_doc["recipient_id"]),
+            "count": {"$lt": MESSAGE_BUCKET_SIZE}
+        },
+        {
+            "$push": {"messages": message_doc},
+            "$inc": {"count": 1},
+            "$min": {"start": message_doc["created_at"]},
+            "$max": {"end": message_doc["created_at"]},
+            "$setOnInsert": {
+                "id": str(uuid.uuid4()),
+                "participants": sorted([message_doc["sender_id"], message_doc["recipient_id"]])
+            }
+        },
+        upsert=True
+    )
+
+async def read_message_buckets(user_a: str, user_b: str, since: Optional[datetime], until: Optional[datetime]) -> List[dict]:
+    # Stored timestamps are naive UTC, so align client-supplied offsets before comparing in Python
+    if since and since.tzinfo:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    if until and until.tzinfo:
+        until = until.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    # Only the buckets overlapping the requested window are fetched
+    bucket_query = {"conversation_id": conversation_key(user_a, user_b)}
+    if since:
+        bucket_query["end"] = {"$gte": since}
+    if until:
+        bucket_query["start"] = {"$lte": until}
+    
+    cursor = db.message_buckets.find(bucket_query, {"_id": 0, "messages": 1}).sort("start", 1)
+    messages = []
+    async for bucket in cursor:
+        for message in bucket["messages"]:
+            if since and message["created_at"] < since:
+                continue
+            if until and message["created_at"] > until:
+                continue
+            messages.append(message)
+    messages.sort(key=lambda m: m["created_at"])
+    return messages
+
+async def migrate_messages_to_buckets(batch_size: int = 1000) -> Dict[str, int]:
+    # Run while the server still stores documents. Bucket ids are derived from each conversation's
+    # message order and written as upserts, so a run that failed part-way can simply be repeated.
+    if MESSAGE_STORAGE == "buckets":
+        raise RuntimeError("MESSAGE_STORAGE is already 'buckets'; migrate before switching storage modes")
+    if await db.message_buckets.count_documents({"migrated": {"$ne": True}}, limit=1):
+        raise RuntimeError("message_buckets holds live buckets; migrating again would duplicate messages")
+    
+    # Messages stream in creation order, so every conversation only keeps one partially filled bucket in memory
+    open_buckets: Dict[str, List[dict]] = {}
+    bucket_numbers: Dict[str, int] = defaultdict(int)
+    pending: List[dict] = []
+    migrated = 0
+    buckets_written = 0
+    
+    def close_bucket(key: str):
+        bucket = new_message_bucket(key, open_buckets.pop(key), f"{key}:{bucket_numbers[key]}")
+        bucket_numbers[key] += 1
+        pending.append(UpdateOne({"id": bucket["id"]}, {"$set": {**bucket, "migrated": True}}, upsert=True))
+    
+    async def flush():
+        nonlocal buckets_written, pending
+        if pending:
+            await db.message_buckets.bulk_write(pending, ordered=False)
+            buckets_written += len(pending)
+            pending = []
+    
+    async for message in db.messages.find({}, {"_id": 0}).sort([("created_at", 1), ("id", 1)]).batch_size(batch_size):
+        key = conversation_key(message["sender_id"], message["recipient_id"])
+        bucket_messages = open_buckets.setdefault(key, [])
+        bucket_messages.append(message)
+        migrated += 1
+        if len(bucket_messages) >= MESSAGE_BUCKET_SIZE:
+            close_bucket(key)
+        if len(pending) >= 100:
+            await flush()
+    
+    for key in list(open_buckets):
+        close_bucket(key)
+    await flush()
+    
+    return {"messages_migrated": migrated, "buckets_written": buckets_written}
+
+class MessageWriteBuffer:
+    # Coalesces concurrent message inserts into insert_many batches flushed by size or timer.
+    # Each caller is only released once the batch holding its document has been acknowledged.
+    def __init__(self, collection, max_batch_size: int, max_delay_ms: float):
+        self.collection = collection
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set = set()
+    
+    async def insert(self, doc: dict):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((doc, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._start_flush)
+        await future
+    
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+    
+    async def _flush(self, batch: List[tuple]):
+        started = time.perf_counter()
+        errors: Dict[int, Exception] = {}
+        try:
+            await self.collection.insert_many([doc for doc, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                errors[write_error["index"]] = Exception(write_error.get("errmsg", "Message insert failed"))
+        except Exception as e:
+            errors = {index: e for index in range(len(batch))}
+        
+        metrics.observe("message_write_batch_size", len(batch))
+        metrics.observe("message_write_flush_ms", (time.perf_counter() - started) * 1000)
+        if errors:
+            metrics.inc("message_write_errors", len(errors))
+        
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(None)
+    
+    async def close(self):
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+message_write_buffer = MessageWriteBuffer(db.messages, MESSAGE_WRITE_BATCH_SIZE, MESSAGE_WRITE_BATCH_DELAY_MS)
+
+@app.on_event("shutdown")
+async def flush_message_writes():
+    await message_write_buffer.close()
+
+async def notify_rejected_bidders(job_id: str, job_title: str, selected_bid_id: str):
+    losing_bids = await db.bids.find(
+        {"job_id": job_id, "id": {"$ne": selected_bid_id}},
+        {"_id": 0, "id": 1, "bidder_id": 1}
+    ).to_list(length=None)
+    if not losing_bids:
+        return
+    
+    now = datetime.utcnow()
+    await db.notifications.insert_many([
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": bid["bidder_id"],
+            "type": "bid_rejected",
+            "job_id": job_id,
+            "bid_id": bid["id"],
+            "content": f"Another provider was selected for \"{job_title}\"",
+            "created_at": now,
+            "is_read": False
+        }
+        for bid in losing_bids
+    ], ordered=False)
+
+async def find_duplicate_bids() -> List[dict]:
+    return await db.bids.aggregate([
+        {"$group": {
+            "_id": {"job_id": "$job_id", "bidder_id": "$bidder_id"},
+            "count": {"$sum": 1},
+            "bids": {"$push": {"id": "$id", "is_selected": "$is_selected", "created_at": "$created_at"}}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True).to_list(length=None)
+
+async def dedupe_bids() -> int:
+    # Keeps the selected bid of each duplicated pair, otherwise the earliest, and fixes the job's bids_count
+    removed = 0
+    for duplicate in await find_duplicate_bids():
+        bids = sorted(duplicate["bids"], key=lambda bid: (not bid.get("is_selected"), bid["created_at"]))
+        extra_ids = [bid["id"] for bid in bids[1:]]
+        result = await db.bids.delete_many({"id": {"$in": extra_ids}})
+        await db.jobs.update_one({"id": duplicate["_id"]["job_id"]}, {"$inc": {"bids_count": -result.deleted_count}})
+        removed += result.deleted_count
+    return removed
+
+def build_job_doc(job_data: JobCreate, current_user: dict) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "title": job_data.title,
+        "description": job_data.description,
+        "category": job_data.category,
+        "budget_min": job_data.budget_min,
+        "budget_max": job_data.budget_max,
+        "location": job_data.location,
+        "address": job_data.address,
+        "deadline": job_data.deadline,
+        "requirements": job_data.requirements,
+        "status": JobStatus.OPEN,
+        "creator_id": current_user["id"],
+        "creator_name": current_user["full_name"],
+        "created_at": datetime.utcnow(),
+        "bids_count": 0,
+        "selected_bid_id": None
+    }
+
+# Bulk upload parsing: each iterator yields (row, record, error) without buffering the whole body
+async def iter_body_text(request: Request) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in request.stream():
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+async def iter_body_lines(request: Request) -> AsyncIterator[str]:
+    buffer = ""
+    async for text in iter_body_text(request):
+        buffer += text
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    if buffer:
+        yield buffer.rstrip("\r")
+
+async def iter_ndjson_records(request: Request) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    row = 0
+    async for line in iter_body_lines(request):
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            yield row, json.loads(line), None
+        except json.JSONDecodeError as e:
+            yield row, None, f"Invalid JSON: {e.msg}"
+
+async def iter_csv_records(request: Request) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    # Columns: title, description, category, budget_min, budget_max, lat, lng, address, deadline, requirements
+    # (requirements separated by ";"). Quoted fields may span several lines.
+    fieldnames = None
+    pending = ""
+    row = 0
+    async for line in iter_body_lines(request):
+        pending = f"{pending}\n{line}" if pending else line
+        if pending.count('"') % 2:
+            continue
+        values, pending = next(csv.reader([pending])), ""
+        if fieldnames is None:
+            fieldnames = [name.strip() for name in values]
+            continue
+        if not any(value.strip() for value in values):
+            continue
+        row += 1
+        record = dict(zip(fieldnames, values))
+        if "lat" in record or "lng" in record:
+            record["location"] = {"lat": record.pop("lat", None), "lng": record.pop("lng", None)}
+        requirements = record.get("requirements") or ""
+        record["requirements"] = [r.strip() for r in requirements.split(";") if r.strip()]
+        yield row, record, None
+    if pending:
+        yield row + 1, None, "Unterminated quoted field"
+
+# What may still follow at a decode error when the item was merely cut off by the chunk boundary:
+# nothing, or the start of a literal or number
+JSON_TRUNCATED_TAIL = re.compile(r"\s*(t(r(ue?)?)?|f(a(l(se?)?)?)?|n(u(ll?)?)?|-?\d*(\.\d*)?([eE][-+]?\d*)?)\s*")
+
+def json_item_truncated(buffer: str, error: json.JSONDecodeError) -> bool:
+    if error.msg.startswith("Unterminated string"):
+        return True  # The closing quote has not arrived yet
+    if error.msg.startswith("Invalid \\uXXXX escape") and error.pos >= len(buffer) - 6:
+        return True
+    return JSON_TRUNCATED_TAIL.fullmatch(buffer, error.pos) is not None
+
+async def iter_json_array_records(request: Request) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = finished = False
+    row = 0
+    async for text in iter_body_text(request):
+        buffer += text
+        pos = 0
+        while not finished:
+            while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ",")):
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise HTTPException(status_code=400, detail="Expected a JSON array of jobs")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                finished = True
+                pos += 1
+                break
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if json_item_truncated(buffer, e):
+                    break  # Wait for the rest of this item
+                # Nothing after a malformed item can be located reliably, so stop instead of buffering the rest
+                yield row + 1, None, f"Invalid JSON: {e.msg}; rows after this one were not processed"
+                return
+            row += 1
+            yield row, record, None
+        buffer = buffer[pos:]
+    if not finished:
+        yield row + 1, None, "Malformed or truncated JSON array"
+
+async def insert_job_chunk(chunk: List[Tuple[int, dict]], created_per_category: Dict[str, int]) -> List[dict]:
+    errors: Dict[int, str] = {}
+    try:
+        await db.jobs.insert_many([doc for _, doc in chunk], ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            errors[write_error["index"]] = write_error.get("errmsg", "Insert failed")
+    
+    results = []
+    for index, (row, doc) in enumerate(chunk):
+        if index in errors:
+            results.append({"row": row, "status": "error", "error": errors[index]})
+        else:
+            results.append({"row": row, "status": "created", "job_id": doc["id"]})
+            created_per_category[doc["category"]] += 1
+    return results
+
+async def dispatch_batch_get(path: str, params: Dict[str, Any], authorization: str) -> Tuple[int, Any]:
+    # Runs a GET sub-request straight through the router, skipping the HTTP stack and outer middleware
+    url = urlsplit(path)
+    query_string = "&".join(q for q in [url.query, urlencode(params, doseq=True)] if q)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "root_path": "",
+        "query_string": query_string.encode(),
+        "headers": [(b"authorization", authorization.encode())],
+        "client": None,
+        "server": None,
+        "app": app
+    }
+    response = {"status": 500, "body": []}
+    
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+    
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+    
+    # Wrap the router in the app's own exception handlers so sub-requests render errors
+    # (404, 405, 422 validation errors, HTTPException) exactly like direct requests
+    handlers = {key: handler for key, handler in app.exception_handlers.items() if key not in (500, Exception)}
+    try:
+        await ExceptionMiddleware(app.router, handlers=handlers)(scope, receive, send)
+    except Exception:
+        return 500, {"detail": "Internal server error"}
+    
+    raw_body = b"".join(response["body"])
+    try:
+        body = json.loads(raw_body) if raw_body else None
+    except ValueError:
+        body = {"detail": raw_body.decode("utf-8", errors="replace")}
+    return response["status"], body
+
+async def require_admin(current_user: dict = Depends(get_current_user)):
+    if not current_user.get("is_admin"):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+async def set_admin(email: str, is_admin: bool = True) -> bool:
+    # Admin rights are granted out of band (manage.py grant-admin); there is no API for it
+    result = await db.users.update_one({"email": email}, {"$set": {"is_admin": is_admin}})
+    return result.matched_count == 1
+
+def export_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+async def stream_export(collection: str, filter_query: dict, export_format: str) -> AsyncIterator[str]:
+    # Rows are pulled from a server-side cursor and flushed once per batch, so memory stays flat
+    fields = EXPORT_FIELDS[collection]
+    projection = {"_id": 0, **{field: 1 for field in fields}}
+    cursor = db[collection].find(filter_query, projection).sort("created_at", 1).batch_size(EXPORT_BATCH_SIZE)
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == "csv" else None
+    if writer:
+        writer.writerow(fields)
+    rows = 0
+    
+    async for doc in cursor:
+        if writer:
+            writer.writerow([export_value(doc.get(field)) for field in fields])
+        else:
+            buffer.write(json.dumps({field: export_value(doc.get(field)) for field in fields}, default=str))
+            buffer.write("\n")
+        rows += 1
+        if rows % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue()
+
+# Daily marketplace rollups, one document per (day, category), maintained with $inc
+ROLLUP_FIELDS = [
+    "jobs_posted", "bids_placed", "first_bids", "time_to_first_bid_seconds",
+    "jobs_awarded", "gmv", "payments_released", "escrow_released"
+]
+
+def rollup_day(at: datetime) -> str:
+    return at.strftime("%Y-%m-%d")
+
+async def record_rollup(category: str, increments: Dict[str, float], at: Optional[datetime] = None):
+    await db.marketplace_rollups.update_one(
+        {"day": rollup_day(at or datetime.utcnow()), "category": category},
+        {"$inc": increments, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+async def write_rebuilt_documents(collection, key_fields: List[str], documents: List[dict], started_at: datetime, batch_size: int = 1000):
+    # Rebuilt totals are $set in place rather than swapped in with delete_many + insert_many, so
+    # live upserts never find a missing document or race an insert into a duplicate. Afterwards,
+    # documents the rebuild did not produce are dropped unless a live write touched them since it began.
+    for start in range(0, len(documents), batch_size):
+        await collection.bulk_write([
+            UpdateOne(
+                {field: document[field] for field in key_fields},
+                {"$set": {**document, "updated_at": started_at}},
+                upsert=True
+            )
+            for document in documents[start:start + batch_size]
+        ], ordered=False)
+    await collection.delete_many({"$or": [{"updated_at": {"$lt": started_at}}, {"updated_at": {"$exists": False}}]})
+
+def rollup_pipelines(prefix: str) -> List[Tuple[str, List[dict]]]:
+    # prefix "" reads the live collections and "archive_" the archived ones; a job is archived
+    # together with its bids and settled payments, so lookups stay within the same tier
+    day_of = lambda field: {"$dateToString": {"format": "%Y-%m-%d", "date": field}}
+    job_category = [
+        {"$lookup": {"from": f"{prefix}jobs", "localField": "job_id", "foreignField": "id", "as": "job"}},
+        {"$unwind": "$job"}
+    ]
+    return [
+        (f"{prefix}jobs", [
+            {"$group": {"_id": {"day": day_of("$created_at"), "category": "$category"}, "jobs_posted": {"$sum": 1}}}
+        ]),
+        (f"{prefix}bids", job_category + [
+            {"$group": {"_id": {"day": day_of("$created_at"), "category": "$job.category"}, "bids_placed": {"$sum": 1}}}
+        ]),
+        (f"{prefix}bids", [
+            {"$group": {"_id": "$job_id", "first_bid_at": {"$min": "$created_at"}}},
+            {"$lookup": {"from": f"{prefix}jobs", "localField": "_id", "foreignField": "id", "as": "job"}},
+            {"$unwind": "$job"},
+            {"$group": {
+                "_id": {"day": day_of("$first_bid_at"), "category": "$job.category"},
+                "first_bids": {"$sum": 1},
+                "time_to_first_bid_seconds": {
+                    "$sum": {"$divide": [{"$subtract": ["$first_bid_at", "$job.created_at"]}, 1000]}
+                }
+            }}
+        ]),
+        (f"{prefix}jobs", [
+            {"$match": {"selected_bid_id": {"$ne": None}, "selected_at": {"$exists": True}}},
+            {"$lookup": {"from": f"{prefix}bids", "localField": "selected_bid_id", "foreignField": "id", "as": "bid"}},
+            {"$unwind": "$bid"},
+            {"$group": {
+                "_id": {"day": day_of("$selected_at"), "category": "$category"},
+                "jobs_awarded": {"$sum": 1},
+                "gmv": {"$sum": "$bid.amount"}
+            }}
+        ]),
+        (f"{prefix}payments", [{"$match": {"status": PaymentStatus.RELEASED, "released_at": {"$exists": True}}}] + job_category + [
+            {"$group": {
+                "_id": {"day": day_of("$released_at"), "category": "$job.category"},
+                "payments_released": {"$sum": 1},
+                "escrow_released": {"$sum": "$amount"}
+            }}
+        ])
+    ]
+
+async def backfill_rollups() -> int:
+    # Rebuilds every rollup bucket from the transactional collections, archived records included
+    started_at = datetime.utcnow()
+    buckets: Dict[Tuple[str, str], Dict[str, float]] = {}
+    for collection, pipeline in rollup_pipelines("") + rollup_pipelines("archive_"):
+        async for row in db[collection].aggregate(pipeline, allowDiskUse=True):
+            key = (row["_id"]["day"], row["_id"]["category"])
+            bucket = buckets.setdefault(key, {field: 0 for field in ROLLUP_FIELDS})
+            for field in ROLLUP_FIELDS:
+                if field in row:
+                    bucket[field] += row[field]
+    
+    await write_rebuilt_documents(
+        db.marketplace_rollups, ["day", "category"],
+        [{"day": day, "category": category, **counts} for (day, category), counts in buckets.items()],
+        started_at
+    )
+    return len(buckets)
+
+async def sweep_expired_jobs(batch_size: int = JOB_EXPIRY_BATCH_SIZE) -> int:
+    # Walks the (status, deadline) index in batches so a large backlog never becomes one huge write
+    now = datetime.utcnow()
+    closed = 0
+    while True:
+        expired = await db.jobs.find(
+            {"status": JobStatus.OPEN, "deadline": {"$lt": now}},
+            {"_id": 0, "id": 1}
+        ).limit(batch_size).to_list(length=None)
+        if not expired:
+            break
+        
+        result = await db.jobs.update_many(
+            {"id": {"$in": [job["id"] for job in expired]}, "status": JobStatus.OPEN},
+            {"$set": {"status": JobStatus.CANCELLED, "closed_reason": "deadline_expired", "expired_at": now}}
+        )
+        closed += result.modified_count
+        if len(expired) < batch_size:
+            break
+    
+    metrics.inc("jobs_expired", closed)
+    metrics.observe("job_expiry_sweep_closed", closed)
+    metrics.set_gauge("job_expiry_last_run_closed", closed)
+    return closed
+
+async def run_job_expiry_sweeper():
+    while True:
+        try:
+            closed = await sweep_expired_jobs()
+            logger.info("Job expiry sweep closed %d jobs", closed)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Job expiry sweep failed")
+        await asyncio.sleep(JOB_EXPIRY_SWEEP_INTERVAL)
+
+job_expiry_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_job_expiry_sweeper():
+    global job_expiry_task
+    if JOB_EXPIRY_SWEEP:
+        job_expiry_task = asyncio.create_task(run_job_expiry_sweeper())
+
+@app.on_event("shutdown")
+async def stop_job_expiry_sweeper():
+    if job_expiry_task:
+        job_expiry_task.cancel()
+
+class OwnerCancelled(Exception):
+    # Set on a shared future when the caller doing the work is cancelled; waiters retry instead
+    pass
+
+class IdempotencyStore:
+    # First response per key is kept in a TTL-indexed collection (shared across workers) and in a
+    # small in-process cache. Duplicates arriving while the first call runs wait for its outcome.
+    def __init__(self, collection, ttl_seconds: int, wait_seconds: float, cache_size: int):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        self.cache_size = cache_size
+        self.inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self.recent: Dict[str, Tuple[float, str, Any]] = {}  # key -> (expires_at, fingerprint, response)
+    
+    @staticmethod
+    def fingerprint(payload: Any) -> str:
+        return hashlib.sha256(json.dumps(jsonable_encoder(payload), sort_keys=True).encode()).hexdigest()
+    
+    @staticmethod
+    def check_fingerprint(expected: str, fingerprint: str):
+        if expected != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    
+    async def run(self, key: str, fingerprint: str, handler):
+        cached = self.recent.get(key)
+        if cached and cached[0] > time.monotonic():
+            self.check_fingerprint(cached[1], fingerprint)
+            metrics.inc("idempotency_replayed")
+            return cached[2]
+        
+        if key in self.inflight:
+            expected, future = self.inflight[key]
+            self.check_fingerprint(expected, fingerprint)
+            metrics.inc("idempotency_coalesced")
+            try:
+                return await asyncio.shield(future)
+            except OwnerCancelled:
+                # The first caller went away mid-flight and released its claim; run the request again
+                return await self.run(key, fingerprint, handler)
+        
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = (fingerprint, future)
+        try:
+            response = await self._run_once(key, fingerprint, handler)
+        except asyncio.CancelledError:
+            future.set_exception(OwnerCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved so waiter-less failures are not logged twice
+            raise
+        else:
+            future.set_result(response)
+            self._remember(key, fingerprint, response)
+            return response
+        finally:
+            del self.inflight[key]
+    
+    async def _run_once(self, key: str, fingerprint: str, handler):
+        # A claim is a lease: if its owner dies mid-request, the claim is taken over once it lapses
+        owner = str(uuid.uuid4())
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({
+                "_id": key, "fingerprint": fingerprint, "status": "in_progress", "created_at": now,
+                "owner": owner, "locked_until": now + timedelta(seconds=self.wait_seconds)
+            })
+        except DuplicateKeyError:
+            # Another worker owns this key: replay its stored response once it is available
+            stored = await self._wait_for_stored(key, fingerprint, owner)
+            if stored is not None:
+                metrics.inc("idempotency_replayed")
+                return stored["response"]
+            metrics.inc("idempotency_taken_over")
+        
+        try:
+            response = jsonable_encoder(await handler())
+        except BaseException:
+            await self.collection.delete_one({"_id": key, "owner": owner})
+            raise
+        
+        await self.collection.update_one(
+            {"_id": key, "owner": owner}, {"$set": {"status": "completed", "response": response}, "$unset": {"locked_until": ""}}
+        )
+        return response
+    
+    async def _take_over(self, key: str, owner: str) -> bool:
+        now = datetime.utcnow()
+        result = await self.collection.update_one(
+            {"_id": key, "status": "in_progress", "$or": [
+                {"locked_until": {"$lt": now}},
+                # Claims written before leases existed expire the same time after they were made
+                {"locked_until": {"$exists": False}, "created_at": {"$lt": now - timedelta(seconds=self.wait_seconds)}}
+            ]},
+            {"$set": {"owner": owner, "locked_until": now + timedelta(seconds=self.wait_seconds)}}
+        )
+        return result.modified_count == 1
+    
+    async def _wait_for_stored(self, key: str, fingerprint: str, owner: str) -> Optional[dict]:
+        # Returns the completed record, or None once this caller has taken over an expired claim
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            stored = await self.collection.find_one({"_id": key})
+            if stored:
+                self.check_fingerprint(stored["fingerprint"], fingerprint)
+                if stored["status"] == "completed":
+                    return stored
+                if await self._take_over(key, owner):
+                    return None
+            if not stored or time.monotonic() >= deadline:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still being processed")
+            await asyncio.sleep(0.1)
+    
+    def _remember(self, key: str, fingerprint: str, response: Any):
+        now = time.monotonic()
+        if len(self.recent) >= self.cache_size:
+            for expired_key in [k for k, (expires_at, _, _) in self.recent.items() if expires_at <= now]:
+                del self.recent[expired_key]
+            if len(self.recent) >= self.cache_size:
+                del self.recent[next(iter(self.recent))]
+        self.recent[key] = (now + self.ttl_seconds, fingerprint, response)
+
+idempotency_store = IdempotencyStore(
+    db.idempotency_keys, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_WAIT_SECONDS, IDEMPOTENCY_CACHE_SIZE
+)
+
+async def run_idempotent(idempotency_key: Optional[str], user_id: str, operation: str, payload: Any, handler):
+    if not idempotency_key:
+        return await handler()
+    if len(idempotency_key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be at most 255 characters")
+    key = f"{user_id}:{operation}:{idempotency_key}"
+    return await idempotency_store.run(key, IdempotencyStore.fingerprint(payload), handler)
+
+async def find_with_archive(collection: str, ids: List[str], projection: dict) -> Dict[str, dict]:
+    # Ratings outlive archival, so records missing from the live collection are looked up in the archive
+    docs = await db[collection].find({"id": {"$in": ids}}, projection).to_list(length=None)
+    docs_by_id = {doc["id"]: doc for doc in docs}
+    missing_ids = [doc_id for doc_id in ids if doc_id not in docs_by_id]
+    if missing_ids:
+        archived = await db[f"archive_{collection}"].find({"id": {"$in": missing_ids}}, projection).to_list(length=None)
+        docs_by_id.update((doc["id"], doc) for doc in archived)
+    return docs_by_id
+
+async def find_jobs_with_archive(job_ids: List[str], projection: dict) -> Dict[str, dict]:
+    return await find_with_archive("jobs", job_ids, projection)
+
+# Provider leaderboards, one score document per (provider, category, area) where area "*" is
+# the whole category; the (category, area, score) index makes a top-K page an index walk
+def bayesian_score(rating_sum: float, rating_count: int) -> float:
+    return round((LEADERBOARD_PRIOR_MEAN * LEADERBOARD_PRIOR_WEIGHT + rating_sum) / (LEADERBOARD_PRIOR_WEIGHT + rating_count), 4)
+
+def counts_toward_leaderboard(rating: dict, job: dict, selected_bidders: Dict[str, str]) -> bool:
+    # Only the job creator's rating of the provider whose bid they selected is a provider rating
+    return (
+        rating["rater_id"] == job["creator_id"]
+        and job.get("selected_bid_id") is not None
+        and selected_bidders.get(job["selected_bid_id"]) == rating["target_user_id"]
+    )
+
+async def find_selected_bidders(jobs: Iterable[dict]) -> Dict[str, str]:
+    bid_ids = list({job["selected_bid_id"] for job in jobs if job.get("selected_bid_id")})
+    if not bid_ids:
+        return {}
+    bids = await find_with_archive("bids", bid_ids, {"_id": 0, "id": 1, "bidder_id": 1})
+    return {bid_id: bid["bidder_id"] for bid_id, bid in bids.items()}
+
+def leaderboard_area(location: Optional[Dict[str, float]]) -> Optional[str]:
+    if not location or location.get("lat") is None or location.get("lng") is None:
+        return None
+    return f"{round(location['lat'], LEADERBOARD_AREA_PRECISION)}:{round(location['lng'], LEADERBOARD_AREA_PRECISION)}"
+
+async def record_provider_rating(provider_id: str, category: str, location: Optional[Dict[str, float]], rating: int):
+    # The score is derived from the new sums inside the same update, so concurrent ratings cannot
+    # leave a score computed from another rating's totals; both areas go out in one round-trip
+    await db.provider_scores.bulk_write([
+        UpdateOne(
+            {"provider_id": provider_id, "category": category, "area": area},
+            [
+                {"$set": {
+                    "rating_sum": {"$add": [{"$ifNull": ["$rating_sum", 0]}, rating]},
+                    "rating_count": {"$add": [{"$ifNull": ["$rating_count", 0]}, 1]}
+                }},
+                {"$set": {
+                    "score": {"$round": [{"$divide": [
+                        {"$add": [LEADERBOARD_PRIOR_MEAN * LEADERBOARD_PRIOR_WEIGHT, "$rating_sum"]},
+                        {"$add": [LEADERBOARD_PRIOR_WEIGHT, "$rating_count"]}
+                    ]}, 4]},
+                    "updated_at": datetime.utcnow()
+                }}
+            ],
+            upsert=True
+        )
+        for area in filter(None, ["*", leaderboard_area(location)])
+    ], ordered=False)
+
+async def rebuild_leaderboards(batch_size: int = 1000) -> int:
+    # Replays every provider rating; jobs and their selected bids are fetched per batch, not per rating
+    started_at = datetime.utcnow()
+    totals: Dict[Tuple[str, str, str], List[float]] = {}
+    batch: List[dict] = []
+    
+    async def flush(ratings: List[dict]):
+        jobs_by_id = await find_jobs_with_archive(
+            list({r["job_id"] for r in ratings}),
+            {"_id": 0, "id": 1, "category": 1, "location": 1, "creator_id": 1, "selected_bid_id": 1}
+        )
+        selected_bidders = await find_selected_bidders(jobs_by_id.values())
+        for rating in ratings:
+            job = jobs_by_id.get(rating["job_id"])
+            if not job or not counts_toward_leaderboard(rating, job, selected_bidders):
+                continue
+            for area in filter(None, ["*", leaderboard_area(job.get("location"))]):
+                entry = totals.setdefault((rating["target_user_id"], job["category"], area), [0, 0])
+                entry[0] += rating["rating"]
+                entry[1] += 1
+    
+    async for rating in db.ratings.find({}, {"_id": 0, "job_id": 1, "rater_id": 1, "target_user_id": 1, "rating": 1}).batch_size(batch_size):
+        batch.append(rating)
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    
+    await write_rebuilt_documents(
+        db.provider_scores, ["provider_id", "category", "area"],
+        [
+            {
+                "provider_id": provider_id, "category": category, "area": area,
+                "rating_sum": rating_sum, "rating_count": rating_count,
+                "score": bayesian_score(rating_sum, rating_count)
+            }
+            for (provider_id, category, area), (rating_sum, rating_count) in totals.items()
+        ],
+        started_at
+    )
+    return len(totals)
+
+# Bid price sketches, one document per (category, area, kind) with kind "bids" or "wins". Amounts
+# are counted in logarithmic buckets, so sketches merge by adding counts and a lookup reads a
+# bounded number of buckets no matter how many bids have been placed.
+PRICE_SKETCH_GAMMA = (1 + PRICE_SKETCH_RELATIVE_ACCURACY) / (1 - PRICE_SKETCH_RELATIVE_ACCURACY)
+PRICE_SKETCH_LOG_GAMMA = math.log(PRICE_SKETCH_GAMMA)
+
+def price_bucket(amount: float) -> int:
+    return math.ceil(math.log(amount) / PRICE_SKETCH_LOG_GAMMA)
+
+def price_bucket_value(bucket: int) -> float:
+    return 2 * PRICE_SKETCH_GAMMA ** bucket / (PRICE_SKETCH_GAMMA + 1)
+
+def price_sketch_areas(location: Optional[Dict[str, float]]) -> List[str]:
+    return list(filter(None, ["*", leaderboard_area(location)]))
+
+async def record_bid_price(category: str, location: Optional[Dict[str, float]], amount: int, kind: str):
+    if amount <= 0:
+        return
+    await db.bid_price_sketches.bulk_write([
+        UpdateOne(
+            {"category": category, "area": area, "kind": kind},
+            {"$inc": {f"buckets.{price_bucket(amount)}": 1, "count": 1}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        for area in price_sketch_areas(location)
+    ], ordered=False)
+
+def sketch_percentiles(sketch: Optional[dict]) -> Optional[Dict[str, Any]]:
+    if not sketch or not sketch.get("count"):
+        return None
+    buckets = sorted((int(bucket), count) for bucket, count in sketch["buckets"].items())
+    summary: Dict[str, Any] = {"count": sketch["count"]}
+    cumulative, position = 0, 0
+    for percentile in PRICE_GUIDANCE_PERCENTILES:
+        rank = percentile / 100 * (sketch["count"] - 1)
+        while cumulative + buckets[position][1] <= rank:
+            cumulative += buckets[position][1]
+            position += 1
+        summary[f"p{percentile}"] = round(price_bucket_value(buckets[position][0]))
+    return summary
+
+async def rebuild_bid_price_sketches(batch_size: int = 1000) -> int:
+    # Replays all bids, including archived ones, and buckets each group's amounts with NumPy
+    started_at = datetime.utcnow()
+    amounts: Dict[Tuple[str, str, str], List[int]] = defaultdict(list)
+    
+    for bids_collection, jobs_collection in ((db.bids, db.jobs), (db.archive_bids, db.archive_jobs)):
+        batch: List[dict] = []
+        
+        async def flush(bids: List[dict]):
+            jobs = await jobs_collection.find(
+                {"id": {"$in": list({bid["job_id"] for bid in bids})}},
+                {"_id": 0, "id": 1, "category": 1, "location": 1}
+            ).to_list(length=None)
+            jobs_by_id = {job["id"]: job for job in jobs}
+            for bid in bids:
+                job = jobs_by_id.get(bid["job_id"])
+                if not job or bid["amount"] <= 0:
+                    continue
+                kinds = ["bids", "wins"] if bid.get("is_selected") else ["bids"]
+                for area in price_sketch_areas(job.get("location")):
+                    for kind in kinds:
+                        amounts[(job["category"], area, kind)].append(bid["amount"])
+        
+        async for bid in bids_collection.find({}, {"_id": 0, "job_id": 1, "amount": 1, "is_selected": 1}).batch_size(batch_size):
+            batch.append(bid)
+            if len(batch) >= batch_size:
+                await flush(batch)
+                batch = []
+        if batch:
+            await flush(batch)
+    
+    sketches = []
+    for (category, area, kind), values in amounts.items():
+        buckets, counts = np.unique(
+            np.ceil(np.log(np.asarray(values, dtype=np.float64)) / PRICE_SKETCH_LOG_GAMMA).astype(np.int64),
+            return_counts=True
+        )
+        sketches.append({
+            "category": category, "area": area, "kind": kind, "count": len(values),
+            "buckets": {str(bucket): int(count) for bucket, count in zip(buckets.tolist(), counts.tolist())}
+        })
+    
+    await write_rebuilt_documents(db.bid_price_sketches, ["category", "area", "kind"], sketches, started_at)
+    return len(sketches)
+
+class SingleFlightCache:
+    # Short-TTL cache where concurrent misses for a key share one load. Invalidation unregisters the
+    # key's in-flight load so a load that started before the write can never repopulate the cache
+    # with stale data; no per-key state outlives the entry or the load.
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: Dict[str, Tuple[float, Any]] = {}
+        self.inflight: Dict[str, asyncio.Future] = {}
+    
+    async def get(self, key: str, loader):
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            metrics.inc(f"{self.name}_cache_hit")
+            return entry[1]
+        
+        if key in self.inflight:
+            metrics.inc(f"{self.name}_cache_coalesced")
+            try:
+                return await asyncio.shield(self.inflight[key])
+            except OwnerCancelled:
+                # The loading caller was cancelled and unregistered its load; start (or join) a new one
+                return await self.get(key, loader)
+        
+        metrics.inc(f"{self.name}_cache_miss")
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        fresh = False
+        try:
+            value = await loader()
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else OwnerCancelled())
+            future.exception()
+            raise
+        finally:
+            fresh = self.inflight.get(key) is future
+            if fresh:
+                del self.inflight[key]
+        
+        future.set_result(value)
+        if fresh:
+            if len(self.entries) >= self.max_entries:
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        return value
+    
+    def invalidate(self, key: str):
+        self.entries.pop(key, None)
+        self.inflight.pop(key, None)
+
+job_detail_cache = SingleFlightCache("job_detail", JOB_DETAIL_CACHE_TTL_SECONDS, JOB_DETAIL_CACHE_SIZE)
+
+async def assemble_job_details(job_id: str) -> dict:
+    jobs, bids_collection = db.jobs, db.bids
+    job = await jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        # Closed jobs may have been moved to the archive together with their bids
+        jobs, bids_collection = db.archive_jobs, db.archive_bids
+        job = await jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    # Get bids for this job
+    bids_cursor = bids_collection.find({"job_id": job_id}, {"_id": 0}).sort("created_at", -1)
+    bids = await bids_cursor.to_list(length=None)
+    
+    # Add bidder information with a single lookup for all bidders
+    bidders = await db.users.find(
+        {"id": {"$in": list({bid["bidder_id"] for bid in bids})}},
+        {"_id": 0, "id": 1, "full_name": 1, "rating": 1}
+    ).to_list(length=None)
+    bidders_by_id = {bidder["id"]: bidder for bidder in bidders}
+    for bid in bids:
+        bidder = bidders_by_id.get(bid["bidder_id"])
+        if bidder:
+            bid["bidder_name"] = bidder["full_name"]
+            bid["bidder_rating"] = bidder.get("rating", 0.0)
+    
+    job["bids"] = bids
+    return {"job": job}
+
+def job_feed_filter(category: Optional[JobCategory], status: Optional[JobStatus], current_user: dict) -> dict:
+    filter_query = {}
+    if category:
+        filter_query["category"] = category
+    if status:
+        filter_query["status"] = status
+    
+    # Service providers see all open jobs, service seekers see their own jobs
+    if current_user["role"] == UserRole.PENCARI_JASA:
+        filter_query["creator_id"] = current_user["id"]
+    else:
+        filter_query["status"] = JobStatus.OPEN
+        if JOB_EXPIRY_FILTER_AT_QUERY:
+            # Hide jobs whose deadline passed but that the sweeper has not closed yet
+            filter_query["deadline"] = {"$gt": datetime.utcnow()}
+    return filter_query
+
+job_facets_cache = SingleFlightCache("job_facets", JOB_FACETS_CACHE_TTL_SECONDS, 1000)
+
+async def compute_job_facets(filter_query: dict, read_db) -> dict:
+    # Category counts ignore the category filter itself so clients can show the alternatives
+    category = filter_query.pop("category", None)
+    selected = [{"$match": {"category": category}}] if category else []
+    # Bucket boundaries come back as BSON dates, which only keep millisecond precision
+    now = datetime.utcnow()
+    now = now.replace(microsecond=now.microsecond - now.microsecond % 1000)
+    # Deadlines before now land in a leading bucket so they are not counted as "later"; the
+    # "overdue" count itself only covers open jobs the sweeper has not closed yet
+    overdue_since = datetime(1970, 1, 1)
+    deadline_boundaries = [overdue_since, now] + [now + offset for _, offset in JOB_DEADLINE_BUCKETS]
+    
+    pipeline = [
+        {"$match": filter_query},
+        {"$facet": {
+            "categories": [{"$group": {"_id": "$category", "count": {"$sum": 1}}}],
+            "total": selected + [{"$count": "count"}],
+            "budget": selected + [{"$bucket": {
+                "groupBy": "$budget_max",
+                "boundaries": JOB_BUDGET_BUCKETS,
+                "default": "over",
+                "output": {"count": {"$sum": 1}}
+            }}],
+            "overdue": selected + [{"$match": {"status": JobStatus.OPEN, "deadline": {"$lt": now}}}, {"$count": "count"}],
+            "deadlines": selected + [{"$bucket": {
+                "groupBy": "$deadline",
+                "boundaries": deadline_boundaries,
+                "default": "other",
+                "output": {"count": {"$sum": 1}}
+            }}]
+        }}
+    ]
+    facets = (await read_db.jobs.aggregate(pipeline).to_list(length=1))[0]
+    
+    category_counts = {c["_id"]: c["count"] for c in facets["categories"]}
+    budget_counts = {b["_id"]: b["count"] for b in facets["budget"]}
+    deadline_counts = {b["_id"]: b["count"] for b in facets["deadlines"]}
+    return {
+        "total": facets["total"][0]["count"] if facets["total"] else 0,
+        "categories": [{"category": c.value, "count": category_counts.get(c.value, 0)} for c in JobCategory],
+        "budget": [
+            {"min": lower, "max": upper, "count": budget_counts.get(lower, 0)}
+            for lower, upper in zip(JOB_BUDGET_BUCKETS, JOB_BUDGET_BUCKETS[1:])
+        ] + [{"min": JOB_BUDGET_BUCKETS[-1], "max": None, "count": budget_counts.get("over", 0)}],
+        "deadlines": [{"within": "overdue", "count": facets["overdue"][0]["count"] if facets["overdue"] else 0}] + [
+            {"within": label, "count": deadline_counts.get(lower, 0)}
+            for (label, _), lower in zip(JOB_DEADLINE_BUCKETS, deadline_boundaries[1:])
+        ] + [{"within": "later", "count": deadline_counts.get("other", 0)}],
+        "generated_at": now
+    }
+
+async def collection_footprint(collection: str) -> Optional[Dict[str, int]]:
+    try:
+        stats = await db.command("collStats", collection)
+    except Exception:
+        return None  # Not available on every backend
+    return {"size": stats.get("size", 0), "index_size": stats.get("totalIndexSize", 0)}
+
+async def copy_to_archive(collection: str, docs: List[dict]):
+    # Re-running after a crash between copy and delete simply finds the copies already there
+    if not docs:
+        return
+    try:
+        await db[f"archive_{collection}"].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+async def archive_closed_jobs(older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE) -> Dict[str, Any]:
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    closed_query = {
+        "status": {"$in": [JobStatus.COMPLETED, JobStatus.CANCELLED]},
+        "$or": [
+            {"completed_at": {"$lt": cutoff}},
+            {"expired_at": {"$lt": cutoff}},
+            {"completed_at": {"$exists": False}, "expired_at": {"$exists": False}, "created_at": {"$lt": cutoff}}
+        ]
+    }
+    before = {collection: await collection_footprint(collection) for collection in ARCHIVED_COLLECTIONS}
+    moved = {collection: 0 for collection in ARCHIVED_COLLECTIONS}
+    
+    while True:
+        jobs = await db.jobs.find(closed_query).limit(batch_size).to_list(length=None)
+        if not jobs:
+            break
+        job_ids = [job["id"] for job in jobs]
+        bids = await db.bids.find({"job_id": {"$in": job_ids}}).to_list(length=None)
+        payments = await db.payments.find({
+            "job_id": {"$in": job_ids},
+            "status": {"$in": [PaymentStatus.RELEASED, PaymentStatus.REFUNDED]}
+        }).to_list(length=None)
+        
+        # Copy everything first and delete afterwards, so a record always exists somewhere
+        for collection, docs in (("jobs", jobs), ("bids", bids), ("payments", payments)):
+            await copy_to_archive(collection, docs)
+        for collection, docs in (("payments", payments), ("bids", bids), ("jobs", jobs)):
+            if docs:
+                result = await db[collection].delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+                moved[collection] += result.deleted_count
+        for job_id in job_ids:
+            job_detail_cache.invalidate(job_id)
+        
+        if len(jobs) < batch_size:
+            break
+    
+    report: Dict[str, Any] = {"cutoff": cutoff, "moved": moved, "reclaimed": {}}
+    for collection in ARCHIVED_COLLECTIONS:
+        after = await collection_footprint(collection)
+        if before[collection] and after:
+            report["reclaimed"][collection] = {
+                "bytes": before[collection]["size"] - after["size"],
+                "index_bytes": before[collection]["index_size"] - after["index_size"]
+            }
+    metrics.inc("archived_jobs", moved["jobs"])
+    return report
+
+async def count_with_archive(collection: str, filter_query: dict, read_db=None) -> int:
+    read_db = read_db or db
+    hot, archived = await asyncio.gather(
+        read_db[collection].count_documents(filter_query),
+        read_db[f"archive_{collection}"].count_documents(filter_query)
+    )
+    return hot + archived
+
 # Mock Payment Handlers
 class MockPaymentHandler:
     @staticmethod
@@ -248,37 +1893,68 @@ async def get_user_profile(current_user: dict = Depends(get_current_user)):
     }
 
 @app.post("/api/jobs")
-async def create_job(job_data: JobCreate, current_user: dict = Depends(get_current_user)):
+async def create_job(job_data: JobCreate, background_tasks: BackgroundTasks, current_user: dict = Depends(get_current_user)):
     if current_user["role"] != UserRole.PENCARI_JASA:
         raise HTTPException(status_code=403, detail="Only service seekers can create jobs")
     
-    job_id = str(uuid.uuid4())
-    job_doc = {
-        "id": job_id,
-        "title": job_data.title,
-        "description": job_data.description,
-        "category": job_data.category,
-        "budget_min": job_data.budget_min,
-        "budget_max": job_data.budget_max,
-        "location": job_data.location,
-        "address": job_data.address,
-        "deadline": job_data.deadline,
-        "requirements": job_data.requirements,
-        "status": JobStatus.OPEN,
-        "creator_id": current_user["id"],
-        "creator_name": current_user["full_name"],
-        "created_at": datetime.utcnow(),
-        "bids_count": 0,
-        "selected_bid_id": None
-    }
+    job_doc = build_job_doc(job_data, current_user)
+    job_id = job_doc["id"]
     
     await db.jobs.insert_one(job_doc)
+    background_tasks.add_task(record_rollup, job_doc["category"], {"jobs_posted": 1})
     
     # Return the job without MongoDB's _id field - explicitly exclude it
     job_response = {k: v for k, v in job_doc.items() if k != "_id"}
     
     return {"message": "Job created successfully", "job_id": job_id, "job": job_response}
 
+@app.post("/api/jobs/bulk")
+async def create_jobs_bulk(request: Request, current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != UserRole.PENCARI_JASA:
+        raise HTTPException(status_code=403, detail="Only service seekers can create jobs")
+    
+    # JSON array by default; NDJSON or CSV when the Content-Type says so
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        records = iter_ndjson_records(request)
+    elif content_type == "text/csv":
+        records = iter_csv_records(request)
+    else:
+        records = iter_json_array_records(request)
+    
+    results = []
+    chunk: List[Tuple[int, dict]] = []
+    created_per_category: Dict[str, int] = defaultdict(int)
+    async for row, record, error in records:
+        if error is None:
+            try:
+                job_data = JobCreate.model_validate(record)
+            except ValidationError as e:
+                error = "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+        if error is not None:
+            results.append({"row": row, "status": "error", "error": error})
+            continue
+        
+        chunk.append((row, build_job_doc(job_data, current_user)))
+        if len(chunk) >= JOB_BULK_CHUNK_SIZE:
+            results.extend(await insert_job_chunk(chunk, created_per_category))
+            chunk = []
+    
+    if chunk:
+        results.extend(await insert_job_chunk(chunk, created_per_category))
+    
+    results.sort(key=lambda r: r["row"])
+    created = sum(1 for r in results if r["status"] == "created")
+    for category, count in created_per_category.items():
+        if count:
+            await record_rollup(category, {"jobs_posted": count})
+    return {
+        "message": "Bulk job upload processed",
+        "created": created,
+        "failed": len(results) - created,
+        "results": results
+    }
+
 @app.get("/api/jobs")
 async def get_jobs(
     category: Optional[JobCategory] = None,
@@ -287,64 +1963,56 @@ async def get_jobs(
     skip: int = 0,
     current_user: dict = Depends(get_current_user)
 ):
-    filter_query = {}
-    if category:
-        filter_query["category"] = category
-    if status:
-        filter_query["status"] = status
+    filter_query = job_feed_filter(category, status, current_user)
     
-    # Service providers see all open jobs, service seekers see their own jobs
-    if current_user["role"] == UserRole.PENCARI_JASA:
-        filter_query["creator_id"] = current_user["id"]
-    else:
-        filter_query["status"] = JobStatus.OPEN
+    # Seekers read from the primary so a job they just posted is always listed
+    read_db = db if current_user["role"] == UserRole.PENCARI_JASA else secondary_db
     
-    cursor = db.jobs.find(filter_query, {"_id": 0}).skip(skip).limit(limit).sort("created_at", -1)
+    cursor = read_db.jobs.find(filter_query, {"_id": 0}).skip(skip).limit(limit).sort("created_at", -1)
     jobs = await cursor.to_list(length=None)
     
     # Add bid count for each job
     for job in jobs:
-        job["bids_count"] = await db.bids.count_documents({"job_id": job["id"]})
+        job["bids_count"] = await read_db.bids.count_documents({"job_id": job["id"]})
     
     return {"jobs": jobs}
 
+@app.get("/api/jobs/facets")
+async def get_job_facets(
+    category: Optional[JobCategory] = None,
+    status: Optional[JobStatus] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    filter_query = job_feed_filter(category, status, current_user)
+    # Seekers' own jobs are read from the primary and not cached, so a job they just posted or
+    # closed is counted at once, as in get_jobs; nobody else shares their filter set anyway
+    if current_user["role"] == UserRole.PENCARI_JASA:
+        return await compute_job_facets(filter_query, db)
+    
+    # The provider feed is shared per category and refreshed every JOB_FACETS_CACHE_TTL_SECONDS
+    return await job_facets_cache.get(f"provider:{category}", lambda: compute_job_facets(filter_query, secondary_db))
+
 @app.get("/api/jobs/{job_id}")
 async def get_job_details(job_id: str, current_user: dict = Depends(get_current_user)):
-    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
-    if not job:
-        raise HTTPException(status_code=404, detail="Job not found")
-    
-    # Get bids for this job
-    bids_cursor = db.bids.find({"job_id": job_id}, {"_id": 0}).sort("created_at", -1)
-    bids = await bids_cursor.to_list(length=None)
-    
-    # Add bidder information
-    for bid in bids:
-        bidder = await db.users.find_one({"id": bid["bidder_id"]}, {"_id": 0})
-        if bidder:
-            bid["bidder_name"] = bidder["full_name"]
-            bid["bidder_rating"] = bidder.get("rating", 0.0)
-    
-    job["bids"] = bids
-    return {"job": job}
+    return await job_detail_cache.get(job_id, lambda: assemble_job_details(job_id))
 
 @app.post("/api/jobs/{job_id}/bids")
-async def create_bid(job_id: str, bid_data: BidCreate, current_user: dict = Depends(get_current_user)):
+async def create_bid(
+    job_id: str,
+    bid_data: BidCreate,
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     if current_user["role"] != UserRole.PENYEDIA_JASA:
         raise HTTPException(status_code=403, detail="Only service providers can place bids")
     
-    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
-    if not job:
-        raise HTTPException(status_code=404, detail="Job not found")
-    
-    if job["status"] != JobStatus.OPEN:
-        raise HTTPException(status_code=400, detail="Job is not open for bidding")
-    
-    # Check if user already bid
-    existing_bid = await db.bids.find_one({"job_id": job_id, "bidder_id": current_user["id"]}, {"_id": 0})
-    if existing_bid:
-        raise HTTPException(status_code=400, detail="You have already placed a bid on this job")
-    
+    return await run_idempotent(
+        idempotency_key, current_user["id"], "create_bid", {"job_id": job_id, "bid": bid_data},
+        lambda: place_bid(job_id, bid_data, background_tasks, current_user)
+    )
+
+async def place_bid(job_id: str, bid_data: BidCreate, background_tasks: BackgroundTasks, current_user: dict):
     bid_id = str(uuid.uuid4())
     bid_doc = {
         "id": bid_id,
@@ -355,44 +2023,98 @@ async def create_bid(job_id: str, bid_data: BidCreate, current_user: dict = Depe
         "message": bid_data.message,
         "completion_time": bid_data.completion_time,
         "created_at": datetime.utcnow(),
-        "is_selected": False
+        "is_selected": False,
+        "status": BidStatus.PENDING
     }
     
-    await db.bids.insert_one(bid_doc)
+    # The unique (job_id, bidder_id) index rejects duplicate bids, even concurrent ones
+    try:
+        await db.bids.insert_one(bid_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="You have already placed a bid on this job")
+    
+    # Only count the bid while the job is still open; otherwise roll the bid back. A bid on an
+    # unknown or closed job is therefore visible to readers for the moment until it is deleted.
+    job = await db.jobs.find_one_and_update(
+        {"id": job_id, "status": JobStatus.OPEN},
+        {"$inc": {"bids_count": 1}},
+        projection={"_id": 0, "category": 1, "location": 1, "created_at": 1, "bids_count": 1}
+    )
+    if not job:
+        await db.bids.delete_one({"id": bid_id})
+        if not await db.jobs.count_documents({"id": job_id}, limit=1):
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=400, detail="Job is not open for bidding")
     
-    # Update job bid count
-    await db.jobs.update_one({"id": job_id}, {"$inc": {"bids_count": 1}})
+    # The job is returned as it was before the increment, so a zero count means this is the first bid
+    increments = {"bids_placed": 1}
+    if not job.get("bids_count"):
+        increments["first_bids"] = 1
+        increments["time_to_first_bid_seconds"] = (bid_doc["created_at"] - job["created_at"]).total_seconds()
+    background_tasks.add_task(record_rollup, job["category"], increments)
+    background_tasks.add_task(record_bid_price, job["category"], job.get("location"), bid_data.amount, "bids")
+    job_detail_cache.invalidate(job_id)
     
     return {"message": "Bid placed successfully", "bid_id": bid_id}
 
 @app.post("/api/jobs/{job_id}/select-bid/{bid_id}")
-async def select_bid(job_id: str, bid_id: str, current_user: dict = Depends(get_current_user)):
-    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
-    if not job:
-        raise HTTPException(status_code=404, detail="Job not found")
-    
-    if job["creator_id"] != current_user["id"]:
-        raise HTTPException(status_code=403, detail="Only job creator can select bids")
-    
-    bid = await db.bids.find_one({"id": bid_id, "job_id": job_id}, {"_id": 0})
+async def select_bid(
+    job_id: str,
+    bid_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
+    bid = await db.bids.find_one({"id": bid_id, "job_id": job_id}, {"_id": 0, "amount": 1})
     if not bid:
         raise HTTPException(status_code=404, detail="Bid not found")
     
-    # Update job and bid status
-    await db.jobs.update_one({"id": job_id}, {
-        "$set": {
+    # Transition OPEN -> IN_PROGRESS atomically so two selections can never both win
+    job = await db.jobs.find_one_and_update(
+        {"id": job_id, "creator_id": current_user["id"], "status": JobStatus.OPEN},
+        {"$set": {
             "selected_bid_id": bid_id,
             "status": JobStatus.IN_PROGRESS,
             "selected_at": datetime.utcnow()
-        }
-    })
+        }},
+        projection={"_id": 0, "id": 1, "title": 1, "category": 1, "location": 1}
+    )
+    if not job:
+        existing_job = await db.jobs.find_one({"id": job_id}, {"_id": 0, "creator_id": 1})
+        if not existing_job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if existing_job["creator_id"] != current_user["id"]:
+            raise HTTPException(status_code=403, detail="Only job creator can select bids")
+        raise HTTPException(status_code=400, detail="Job is not open for bid selection")
     
-    await db.bids.update_one({"id": bid_id}, {"$set": {"is_selected": True}})
+    # Resolve every bid on the job in one round-trip
+    await db.bids.bulk_write([
+        UpdateOne({"id": bid_id}, {"$set": {"is_selected": True, "status": BidStatus.SELECTED}}),
+        UpdateMany(
+            {"job_id": job_id, "id": {"$ne": bid_id}},
+            {"$set": {"is_selected": False, "status": BidStatus.REJECTED}}
+        )
+    ], ordered=False)
+    job_detail_cache.invalidate(job_id)
+    
+    background_tasks.add_task(notify_rejected_bidders, job_id, job["title"], bid_id)
+    background_tasks.add_task(record_rollup, job["category"], {"jobs_awarded": 1, "gmv": bid["amount"]})
+    background_tasks.add_task(record_bid_price, job["category"], job.get("location"), bid["amount"], "wins")
     
     return {"message": "Bid selected successfully"}
 
 @app.post("/api/payments/create")
-async def create_payment(payment_data: PaymentCreate, current_user: dict = Depends(get_current_user)):
+async def create_payment(
+    payment_data: PaymentCreate,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    # Retries carrying the same Idempotency-Key replay the first result instead of charging again
+    return await run_idempotent(
+        idempotency_key, current_user["id"], "create_payment", payment_data,
+        lambda: process_payment(payment_data, current_user)
+    )
+
+async def process_payment(payment_data: PaymentCreate, current_user: dict):
     job = await db.jobs.find_one({"id": payment_data.job_id}, {"_id": 0})
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
@@ -453,13 +2175,14 @@ async def confirm_payment(payment_id: str, background_tasks: BackgroundTasks):
             {"id": payment_id},
             {"$set": {"status": PaymentStatus.HELD_IN_ESCROW, "paid_at": datetime.utcnow()}}
         )
+        job_detail_cache.invalidate(payment["job_id"])
         
         return {"message": "Payment confirmed and held in escrow"}
     else:
         raise HTTPException(status_code=400, detail="Payment not confirmed")
 
 @app.post("/api/payments/{payment_id}/release")
-async def release_payment(payment_id: str, current_user: dict = Depends(get_current_user)):
+async def release_payment(payment_id: str, background_tasks: BackgroundTasks, current_user: dict = Depends(get_current_user)):
     payment = await db.payments.find_one({"id": payment_id}, {"_id": 0})
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
@@ -482,15 +2205,31 @@ async def release_payment(payment_id: str, current_user: dict = Depends(get_curr
     )
     
     # Mark job as completed
-    await db.jobs.update_one(
+    job = await db.jobs.find_one_and_update(
         {"id": payment["job_id"]},
-        {"$set": {"status": JobStatus.COMPLETED, "completed_at": datetime.utcnow()}}
+        {"$set": {"status": JobStatus.COMPLETED, "completed_at": datetime.utcnow()}},
+        projection={"_id": 0, "category": 1}
     )
+    job_detail_cache.invalidate(payment["job_id"])
+    if job:
+        background_tasks.add_task(
+            record_rollup, job["category"], {"payments_released": 1, "escrow_released": payment["amount"]}
+        )
     
     return {"message": "Payment released successfully"}
 
 @app.post("/api/messages")
-async def send_message(message_data: MessageCreate, current_user: dict = Depends(get_current_user)):
+async def send_message(
+    message_data: MessageCreate,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    return await run_idempotent(
+        idempotency_key, current_user["id"], "send_message", message_data,
+        lambda: deliver_message(message_data, current_user)
+    )
+
+async def deliver_message(message_data: MessageCreate, current_user: dict):
     message_id = str(uuid.uuid4())
     message_doc = {
         "id": message_id,
@@ -503,25 +2242,105 @@ async def send_message(message_data: MessageCreate, current_user: dict = Depends
         "is_read": False
     }
     
-    await db.messages.insert_one(message_doc)
+    if MESSAGE_STORAGE == "buckets":
+        await append_to_message_bucket(message_doc)
+    elif MESSAGE_WRITE_BATCHING:
+        await message_write_buffer.insert(message_doc)
+    else:
+        await db.messages.insert_one(message_doc)
+    await db.conversations.bulk_write(conversation_summary_updates(message_doc), ordered=False)
     return {"message": "Message sent successfully", "message_id": message_id}
 
+@app.get("/api/inbox")
+async def get_inbox(limit: int = 20, skip: int = 0, current_user: dict = Depends(get_current_user)):
+    cursor = db.conversations.find({"user_id": current_user["id"]}, {"_id": 0}).sort("last_message_at", -1).skip(skip).limit(limit)
+    conversations = await cursor.to_list(length=None)
+    
+    # Senders' own summaries only learn the partner name once the partner replies, so fill the gaps in one lookup
+    missing_ids = [c["partner_id"] for c in conversations if not c.get("partner_name")]
+    if missing_ids:
+        partners = await db.users.find({"id": {"$in": missing_ids}}, {"_id": 0, "id": 1, "full_name": 1}).to_list(length=None)
+        names = {p["id"]: p["full_name"] for p in partners}
+        for conversation in conversations:
+            if not conversation.get("partner_name"):
+                conversation["partner_name"] = names.get(conversation["partner_id"])
+    
+    # The badge count covers every conversation, not just this page
+    unread = await db.conversations.aggregate([
+        {"$match": {"user_id": current_user["id"], "unread_count": {"$gt": 0}}},
+        {"$group": {"_id": None, "total": {"$sum": "$unread_count"}}}
+    ]).to_list(length=None)
+    total_unread = unread[0]["total"] if unread else 0
+    return {"conversations": conversations, "total_unread": total_unread}
+
+@app.post("/api/messages/{user_id}/read")
+async def mark_conversation_read(user_id: str, current_user: dict = Depends(get_current_user)):
+    # Only messages that existed when the conversation was read are marked, and the summary's counter
+    # drops by exactly that many, so a message arriving meanwhile stays unread and counted
+    read_at = datetime.utcnow()
+    read_at = read_at.replace(microsecond=read_at.microsecond - read_at.microsecond % 1000)
+    if MESSAGE_STORAGE == "buckets":
+        conversation_id = conversation_key(current_user["id"], user_id)
+        await db.message_buckets.update_many(
+            {"conversation_id": conversation_id, "messages.is_read": False},
+            {"$set": {"messages.$[m].is_read": True, "messages.$[m].read_at": read_at}},
+            array_filters=[{"m.sender_id": user_id, "m.is_read": False, "m.created_at": {"$lte": read_at}}]
+        )
+        # Array updates only report buckets, so count the messages this call stamped
+        marked = 0
+        async for bucket in db.message_buckets.find(
+            {"conversation_id": conversation_id, "messages.read_at": read_at}, {"_id": 0, "messages": 1}
+        ):
+            marked += sum(1 for m in bucket["messages"] if m["sender_id"] == user_id and m.get("read_at") == read_at)
+    else:
+        result = await db.messages.update_many(
+            {"sender_id": user_id, "recipient_id": current_user["id"], "is_read": False, "created_at": {"$lte": read_at}},
+            {"$set": {"is_read": True, "read_at": read_at}}
+        )
+        marked = result.modified_count
+    
+    if marked:
+        await db.conversations.update_one(
+            {"user_id": current_user["id"], "partner_id": user_id},
+            [{"$set": {"unread_count": {"$max": [0, {"$subtract": [{"$ifNull": ["$unread_count", 0]}, marked]}]}}}]
+        )
+    return {"message": "Conversation marked as read", "marked_read": marked}
+
 @app.get("/api/messages/{user_id}")
-async def get_conversation(user_id: str, current_user: dict = Depends(get_current_user)):
-    cursor = db.messages.find({
+async def get_conversation(
+    user_id: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if MESSAGE_STORAGE == "buckets":
+        messages = await read_message_buckets(current_user["id"], user_id, since, until)
+        return {"messages": messages}
+    
+    filter_query = {
         "$or": [
             {"sender_id": current_user["id"], "recipient_id": user_id},
             {"sender_id": user_id, "recipient_id": current_user["id"]}
         ]
-    }, {"_id": 0}).sort("created_at", 1)
+    }
+    if since or until:
+        filter_query["created_at"] = {}
+        if since:
+            filter_query["created_at"]["$gte"] = since
+        if until:
+            filter_query["created_at"]["$lte"] = until
+    
+    cursor = db.messages.find(filter_query, {"_id": 0}).sort("created_at", 1)
     
     messages = await cursor.to_list(length=None)
     return {"messages": messages}
 
 @app.post("/api/ratings")
-async def create_rating(rating_data: RatingCreate, current_user: dict = Depends(get_current_user)):
-    # Check if job exists and user is involved
+async def create_rating(rating_data: RatingCreate, background_tasks: BackgroundTasks, current_user: dict = Depends(get_current_user)):
+    # Check if job exists and user is involved; old jobs may already have been archived
     job = await db.jobs.find_one({"id": rating_data.job_id}, {"_id": 0})
+    if not job:
+        job = await db.archive_jobs.find_one({"id": rating_data.job_id}, {"_id": 0})
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
@@ -558,17 +2377,85 @@ async def create_rating(rating_data: RatingCreate, current_user: dict = Depends(
         {"$set": {"rating": round(avg_rating, 1), "total_ratings": len(all_ratings)}}
     )
     
+    if counts_toward_leaderboard(rating_doc, job, await find_selected_bidders([job])):
+        background_tasks.add_task(
+            record_provider_rating, rating_data.target_user_id, job["category"], job.get("location"), rating_data.rating
+        )
+    
     return {"message": "Rating submitted successfully"}
 
+@app.get("/api/leaderboards/{category}")
+async def get_leaderboard(
+    category: JobCategory,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    limit: int = 20,
+    skip: int = 0,
+    current_user: dict = Depends(get_current_user)
+):
+    limit = max(1, min(limit, 100))
+    area = leaderboard_area({"lat": lat, "lng": lng}) or "*"
+    cursor = secondary_db.provider_scores.find(
+        {"category": category, "area": area}, {"_id": 0, "updated_at": 0}
+    ).sort("score", -1).skip(skip).limit(limit)
+    entries = await cursor.to_list(length=None)
+    
+    providers = await db.users.find(
+        {"id": {"$in": [entry["provider_id"] for entry in entries]}},
+        {"_id": 0, "id": 1, "full_name": 1}
+    ).to_list(length=None)
+    names = {provider["id"]: provider["full_name"] for provider in providers}
+    
+    for rank, entry in enumerate(entries, start=skip + 1):
+        entry["rank"] = rank
+        entry["provider_name"] = names.get(entry["provider_id"])
+        entry["average_rating"] = round(entry["rating_sum"] / entry["rating_count"], 2) if entry.get("rating_count") else 0.0
+    
+    return {"category": category, "area": area, "entries": entries}
+
+@app.get("/api/price-guidance/{category}")
+async def get_price_guidance(
+    category: JobCategory,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    area = leaderboard_area({"lat": lat, "lng": lng}) or "*"
+    sketches = await secondary_db.bid_price_sketches.find(
+        {"category": category, "area": {"$in": list({area, "*"})}}, {"_id": 0}
+    ).to_list(length=None)
+    by_area = {(sketch["area"], sketch["kind"]): sketch for sketch in sketches}
+    
+    # Areas with too little history fall back to the whole category
+    if area != "*" and by_area.get((area, "bids"), {}).get("count", 0) < PRICE_GUIDANCE_MIN_SAMPLES:
+        area = "*"
+    bids = sketch_percentiles(by_area.get((area, "bids")))
+    wins = sketch_percentiles(by_area.get((area, "wins")))
+    
+    return {
+        "category": category,
+        "area": area,
+        "bids": bids,
+        "winning_bids": wins,
+        "typical_winning_amount": wins["p50"] if wins else None
+    }
+
 @app.get("/api/wallet")
 async def get_wallet_info(current_user: dict = Depends(get_current_user)):
     # Get payment history
-    payments_cursor = db.payments.find({
+    payments_cursor = secondary_db.payments.find({
         "$or": [{"payer_id": current_user["id"]}, {"receiver_id": current_user["id"]}]
     }, {"_id": 0}).sort("created_at", -1).limit(20)
     
     payments = await payments_cursor.to_list(length=None)
     
+    # Top up from the archive when the hot collection no longer holds a full page of history
+    if len(payments) < 20:
+        archived_cursor = secondary_db.archive_payments.find({
+            "$or": [{"payer_id": current_user["id"]}, {"receiver_id": current_user["id"]}]
+        }, {"_id": 0}).sort("created_at", -1).limit(20 - len(payments))
+        payments.extend(await archived_cursor.to_list(length=None))
+    
     return {
         "balance": current_user.get("wallet_balance", 0),
         "recent_transactions": payments
@@ -578,9 +2465,9 @@ async def get_wallet_info(current_user: dict = Depends(get_current_user)):
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
     if current_user["role"] == UserRole.PENCARI_JASA:
         # Service Seeker stats
-        total_jobs = await db.jobs.count_documents({"creator_id": current_user["id"]})
-        active_jobs = await db.jobs.count_documents({"creator_id": current_user["id"], "status": JobStatus.OPEN})
-        completed_jobs = await db.jobs.count_documents({"creator_id": current_user["id"], "status": JobStatus.COMPLETED})
+        total_jobs = await count_with_archive("jobs", {"creator_id": current_user["id"]}, secondary_db)
+        active_jobs = await secondary_db.jobs.count_documents({"creator_id": current_user["id"], "status": JobStatus.OPEN})
+        completed_jobs = await count_with_archive("jobs", {"creator_id": current_user["id"], "status": JobStatus.COMPLETED}, secondary_db)
         
         return {
             "role": "pencari_jasa",
@@ -591,16 +2478,18 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
         }
     else:
         # Service Provider stats
-        total_bids = await db.bids.count_documents({"bidder_id": current_user["id"]})
-        selected_bids = await db.bids.count_documents({"bidder_id": current_user["id"], "is_selected": True})
+        total_bids = await count_with_archive("bids", {"bidder_id": current_user["id"]}, secondary_db)
+        selected_bids = await count_with_archive("bids", {"bidder_id": current_user["id"], "is_selected": True}, secondary_db)
         
-        # Get earnings from completed jobs
-        completed_payments = db.payments.find({
-            "receiver_id": current_user["id"],
-            "status": PaymentStatus.RELEASED
-        }, {"_id": 0})
-        payments = await completed_payments.to_list(length=None)
-        total_earnings = sum(p["amount"] for p in payments)
+        # Get earnings from completed jobs, including archived ones
+        total_earnings = 0
+        for payments_collection in (secondary_db.payments, secondary_db.archive_payments):
+            completed_payments = payments_collection.find({
+                "receiver_id": current_user["id"],
+                "status": PaymentStatus.RELEASED
+            }, {"_id": 0, "amount": 1})
+            payments = await completed_payments.to_list(length=None)
+            total_earnings += sum(p["amount"] for p in payments)
         
         return {
             "role": "penyedia_jasa",
@@ -611,6 +2500,116 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
             "rating": current_user.get("rating", 0.0)
         }
 
+@app.post("/api/batch")
+async def batch_requests(
+    batch: BatchRequest,
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: dict = Depends(get_current_user)
+):
+    if len(batch.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"A batch may contain at most {BATCH_MAX_REQUESTS} requests")
+    
+    async def run(sub_request: BatchSubRequest) -> dict:
+        path = urlsplit(sub_request.path).path
+        if not path.startswith("/api/") or path.startswith("/api/batch"):
+            return {"id": sub_request.id, "path": sub_request.path, "status": 400,
+                    "body": {"detail": "Only /api GET routes can be batched"}}
+        
+        # Each sub-request spends a token from its own route class, as if it had been sent directly
+        route_class, retry_after = await take_rate_limit_token(request, "GET", path)
+        if retry_after > 0:
+            metrics.inc("rate_limit_rejected")
+            metrics.inc(f"rate_limit_rejected.{route_class}")
+            status, body = 429, {"detail": "Too many requests", "retry_after": max(1, math.ceil(retry_after))}
+        else:
+            status, body = await dispatch_batch_get(sub_request.path, sub_request.params, f"Bearer {credentials.credentials}")
+        return {"id": sub_request.id, "path": sub_request.path, "status": status, "body": body}
+    
+    token = batch_user.set(current_user)
+    try:
+        responses = await asyncio.gather(*[run(sub_request) for sub_request in batch.requests])
+    finally:
+        batch_user.reset(token)
+    
+    return {"responses": responses}
+
+@app.get("/api/admin/export/{collection}")
+async def export_collection(
+    collection: str,
+    format: str = "ndjson",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: dict = Depends(require_admin)
+):
+    if collection not in EXPORT_FIELDS:
+        raise HTTPException(status_code=404, detail="Unknown export collection")
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Format must be ndjson or csv")
+    
+    filter_query = {}
+    if start or end:
+        filter_query["created_at"] = {}
+        if start:
+            filter_query["created_at"]["$gte"] = start
+        if end:
+            filter_query["created_at"]["$lt"] = end
+    
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"{collection}.{'csv' if format == 'csv' else 'ndjson'}"
+    return StreamingResponse(
+        stream_export(collection, filter_query, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/api/analytics/rollups")
+async def get_marketplace_rollups(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    category: Optional[JobCategory] = None,
+    current_user: dict = Depends(require_admin)
+):
+    filter_query = {}
+    if start or end:
+        filter_query["day"] = {}
+        if start:
+            filter_query["day"]["$gte"] = start
+        if end:
+            filter_query["day"]["$lte"] = end
+    if category:
+        filter_query["category"] = category
+    
+    rollups = await secondary_db.marketplace_rollups.find(filter_query, {"_id": 0, "updated_at": 0}).sort([("day", 1), ("category", 1)]).to_list(length=None)
+    for rollup in rollups:
+        jobs_posted = rollup.get("jobs_posted", 0)
+        first_bids = rollup.get("first_bids", 0)
+        rollup["bids_per_job"] = round(rollup.get("bids_placed", 0) / jobs_posted, 2) if jobs_posted else None
+        rollup["avg_time_to_first_bid_seconds"] = (
+            round(rollup.get("time_to_first_bid_seconds", 0) / first_bids, 1) if first_bids else None
+        )
+    
+    return {"rollups": rollups}
+
+@app.get("/api/notifications")
+async def get_notifications(limit: int = 20, skip: int = 0, current_user: dict = Depends(get_current_user)):
+    cursor = db.notifications.find({"user_id": current_user["id"]}, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit)
+    notifications = await cursor.to_list(length=None)
+    return {"notifications": notifications}
+
+@app.get("/api/metrics")
+async def get_metrics(current_user: dict = Depends(require_admin)):
+    return metrics.snapshot()
+
+# CORS middleware, registered last so it also wraps responses produced by the middlewares above
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
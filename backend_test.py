@@ -1,6 +1,14 @@
+import asyncio
+import csv
+import io
 import requests
 import sys
+import os
 import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 class WOIYAMarketplaceAPITester:
@@ -56,6 +64,17 @@ class WOIYAMarketplaceAPITester:
             print(f"❌ Failed - Error: {str(e)}")
             return False, {}
 
+    def run_async_test(self, name, scenario):
+        """Run a coroutine returning (passed, detail) against the in-process server's objects"""
+        self.tests_run += 1
+        print(f"\n🔍 Testing {name}...")
+        passed, detail = asyncio.run(scenario())
+        if passed:
+            self.tests_passed += 1
+            print(f"✅ Passed - {detail}")
+        else:
+            print(f"❌ Failed - {detail}")
+
     def test_user_registration(self):
         """Test user registration for both roles"""
         print("\n" + "="*50)
@@ -211,6 +230,71 @@ class WOIYAMarketplaceAPITester:
             self.test_job_id = response['job_id']
             print(f"   Created Job ID: {self.test_job_id}")
 
+    def test_bulk_job_upload(self):
+        """Test streaming bulk job upload for JSON arrays, NDJSON and CSV"""
+        print("\n" + "="*50)
+        print("TESTING BULK JOB UPLOAD")
+        print("="*50)
+        
+        if not self.seeker_token:
+            print("❌ No seeker token available for bulk upload")
+            return
+        
+        deadline = (datetime.now() + timedelta(days=5)).isoformat()
+        job = lambda title: {
+            "title": title,
+            "description": "Pindahan barang \"kecil\", lantai 2",
+            "category": "courier_logistik",
+            "budget_min": 100000,
+            "budget_max": 150000,
+            "location": {"lat": -6.2, "lng": 106.8},
+            "address": "Jl. Merdeka No. 8",
+            "deadline": deadline,
+            "requirements": ["Mobil bak"]
+        }
+        csv_header = "title,description,category,budget_min,budget_max,lat,lng,address,deadline,requirements\n"
+        csv_row = lambda title: (
+            f'{title},"Dua lantai,\nbarang ""berat""",courier_logistik,100000,150000,-6.2,106.8,'
+            f'Jl. Merdeka No. 8,{deadline},Mobil bak;Dua orang\n'
+        )
+        cases = [
+            # (name, content type, body, expected created, expected error rows)
+            ("JSON Array", "application/json",
+             json.dumps([job("Bulk JSON 1"), job("Bulk JSON 2"), job("Bulk JSON 3")]), 3, []),
+            ("JSON Array With Malformed Item", "application/json",
+             "[" + json.dumps(job("Bulk JSON ok")) + ', {"title": tru x}, ' + json.dumps(job("Bulk JSON never read")) + "]",
+             1, [2]),
+            ("NDJSON", "application/x-ndjson",
+             "\n".join([json.dumps(job("Bulk NDJSON 1")), "{not json", json.dumps({"title": "No fields"}),
+                        json.dumps(job("Bulk NDJSON 2"))]) + "\n", 2, [2, 3]),
+            ("CSV With Multi-line Fields", "text/csv",
+             csv_header + csv_row("Bulk CSV 1") + csv_row("Bulk CSV 2") + 'Bulk CSV 3,"never closed\n', 2, [3])
+        ]
+        
+        for name, content_type, body, expected_created, expected_errors in cases:
+            # Seven-byte chunks split every item, string and escape across reads
+            encoded = body.encode()
+            chunks = lambda: (encoded[i:i + 7] for i in range(0, len(encoded), 7))
+            self.tests_run += 1
+            print(f"\n🔍 Testing Bulk Upload: {name}...")
+            try:
+                response = requests.post(
+                    f"{self.base_url}/api/jobs/bulk",
+                    data=chunks(),
+                    headers={'Content-Type': content_type, 'Authorization': f'Bearer {self.seeker_token}'}
+                )
+                result = response.json()
+            except Exception as e:
+                print(f"❌ Failed - Error: {str(e)}")
+                continue
+            error_rows = [r['row'] for r in result.get('results', []) if r['status'] == 'error']
+            if response.status_code == 200 and result.get('created') == expected_created and error_rows == expected_errors:
+                self.tests_passed += 1
+                print(f"✅ Passed - created {result['created']}, error rows {error_rows}")
+            else:
+                print(f"❌ Failed - status {response.status_code}, created {result.get('created')}, error rows {error_rows}")
+                print(f"   Response: {result}")
+
     def test_job_listing(self):
         """Test job listing for both roles"""
         print("\n" + "="*50)
@@ -240,6 +324,137 @@ class WOIYAMarketplaceAPITester:
             if success and 'jobs' in response:
                 print(f"   Found {len(response['jobs'])} available jobs")
 
+    def test_job_expiry(self):
+        """Test that past-deadline jobs leave the feed and are closed by the sweeper (in-process only)"""
+        print("\n" + "="*50)
+        print("TESTING JOB EXPIRY")
+        print("="*50)
+        
+        server = sys.modules.get("server")
+        if server is None or not self.provider_token or not self.seeker_user:
+            print("⚠️  Job expiry can only be tested against the in-process server")
+            return
+        
+        now = datetime.utcnow()
+        expired_ids = [f"expired-{n}-{now.timestamp()}" for n in range(3)]
+        asyncio.run(server.db.jobs.insert_many([
+            {"id": job_id, "creator_id": self.seeker_user['id'], "title": "Kedaluwarsa", "category": "perbaikan_rumah",
+             "status": "open", "budget_min": 50000, "budget_max": 100000, "deadline": now - timedelta(hours=1), "created_at": now}
+            for job_id in expired_ids
+        ]))
+        
+        def feed_ids():
+            response = requests.get(f"{self.base_url}/api/jobs", params={"limit": 100}, headers={'Authorization': f'Bearer {self.provider_token}'})
+            return {job['id'] for job in response.json().get('jobs', [])}
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Feed Hides Past-Deadline Jobs Before the Sweep...")
+        hidden = feed_ids()
+        server.JOB_EXPIRY_FILTER_AT_QUERY = False
+        try:
+            unfiltered = feed_ids()
+        finally:
+            server.JOB_EXPIRY_FILTER_AT_QUERY = True
+        if not hidden & set(expired_ids) and set(expired_ids) <= unfiltered:
+            self.tests_passed += 1
+            print("✅ Passed - expired jobs only listed with the query filter off")
+        else:
+            print(f"❌ Failed - {len(hidden & set(expired_ids))} listed with the filter, {len(unfiltered & set(expired_ids))} without")
+        
+        # A batch size of one makes the sweep walk several batches
+        self.tests_run += 1
+        print("\n🔍 Testing Expiry Sweep Closes Past-Deadline Jobs...")
+        closed = asyncio.run(server.sweep_expired_jobs(batch_size=1))
+        jobs = asyncio.run(server.db.jobs.find({"id": {"$in": expired_ids + [self.test_job_id]}}, {"_id": 0}).to_list(length=None))
+        statuses = {job['id']: (job['status'], job.get('closed_reason')) for job in jobs}
+        swept = all(statuses.get(job_id) == ("cancelled", "deadline_expired") for job_id in expired_ids)
+        untouched = self.test_job_id is None or statuses.get(self.test_job_id, ("open",))[0] == "open"
+        if closed >= len(expired_ids) and swept and untouched and asyncio.run(server.sweep_expired_jobs()) == 0:
+            self.tests_passed += 1
+            print(f"✅ Passed - {closed} jobs closed, open job untouched, second sweep closed none")
+        else:
+            print(f"❌ Failed - closed {closed}, statuses {statuses}")
+        
+        # These jobs bypassed the API (and its rollup counters), so they must not outlive the test
+        asyncio.run(server.db.jobs.delete_many({"id": {"$in": expired_ids}}))
+
+    def test_job_facets(self):
+        """Test faceted counts for the job feed filters"""
+        print("\n" + "="*50)
+        print("TESTING JOB FACETS")
+        print("="*50)
+        
+        if not self.provider_token:
+            print("❌ No provider token available for facets test")
+            return
+        
+        success, response = self.run_test(
+            "Get Job Facets as Provider",
+            "GET",
+            "api/jobs/facets",
+            200,
+            token=self.provider_token
+        )
+        
+        if success and 'categories' in response:
+            print(f"   Open jobs: {response.get('total', 0)}")
+        
+        if not self.seeker_token:
+            return
+        headers = {'Authorization': f'Bearer {self.seeker_token}'}
+        facets_url = f"{self.base_url}/api/jobs/facets"
+        
+        # A seeker's own facets must count a job they just posted, with no cache delay
+        before = requests.get(facets_url, headers=headers).json()
+        job_data = {
+            "title": "Servis AC",
+            "description": "Cuci dan isi freon AC split",
+            "category": "perbaikan_rumah",
+            "budget_min": 100000,
+            "budget_max": 250000,
+            "location": {"lat": -6.2088, "lng": 106.8456},
+            "address": "Jl. Thamrin No. 1, Jakarta Pusat",
+            "deadline": (datetime.now() + timedelta(days=2)).isoformat(),
+            "requirements": []
+        }
+        self.run_test("Create Job Before Facets", "POST", "api/jobs", 200, data=job_data, token=self.seeker_token)
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Seeker Facets Count a New Job Immediately...")
+        after = requests.get(facets_url, headers=headers).json()
+        if after.get('total') == before.get('total', 0) + 1:
+            self.tests_passed += 1
+            print(f"✅ Passed - total {before.get('total')} -> {after.get('total')}")
+        else:
+            print(f"❌ Failed - total {before.get('total')} -> {after.get('total')}")
+        
+        server = sys.modules.get("server")
+        if server is None:
+            return
+        
+        # Only open jobs past their deadline are overdue; closed ones keep their old deadline
+        past = datetime.utcnow() - timedelta(days=1)
+        stale_jobs = [
+            {"id": f"facets-{status}-{past.timestamp()}", "creator_id": self.seeker_user['id'], "category": "perbaikan_rumah",
+             "status": status, "budget_max": 100000, "deadline": past, "created_at": past}
+            for status in ("open", "completed", "cancelled")
+        ]
+        overdue = lambda facets: next(d["count"] for d in facets["deadlines"] if d["within"] == "overdue")
+        before = requests.get(facets_url, headers=headers).json()
+        asyncio.run(server.db.jobs.insert_many(stale_jobs))
+        try:
+            after = requests.get(facets_url, headers=headers).json()
+        finally:
+            asyncio.run(server.db.jobs.delete_many({"id": {"$in": [job["id"] for job in stale_jobs]}}))
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Overdue Facet Counts Open Jobs Only...")
+        if overdue(after) == overdue(before) + 1 and after['total'] == before['total'] + 3:
+            self.tests_passed += 1
+            print(f"✅ Passed - overdue {overdue(before)} -> {overdue(after)}")
+        else:
+            print(f"❌ Failed - overdue {overdue(before)} -> {overdue(after)}, total {before['total']} -> {after['total']}")
+
     def test_job_details(self):
         """Test getting job details"""
         print("\n" + "="*50)
@@ -289,6 +504,162 @@ class WOIYAMarketplaceAPITester:
             self.test_bid_id = response['bid_id']
             print(f"   Created Bid ID: {self.test_bid_id}")
 
+    def test_concurrent_bidding(self, concurrency=200):
+        """Test that simultaneous duplicate bids only create one bid"""
+        print("\n" + "="*50)
+        print("TESTING CONCURRENT BIDDING")
+        print("="*50)
+        
+        if not self.seeker_token or not self.provider_token:
+            print("❌ Missing tokens for concurrent bidding test")
+            return
+        
+        job_data = {
+            "title": "Antar Paket ke Bekasi",
+            "description": "Kirim dua paket kecil ke Bekasi hari ini",
+            "category": "courier_logistik",
+            "budget_min": 50000,
+            "budget_max": 100000,
+            "location": {"lat": -6.2088, "lng": 106.8456},
+            "address": "Jl. Thamrin No. 1, Jakarta Pusat",
+            "deadline": (datetime.now() + timedelta(days=1)).isoformat()
+        }
+        
+        success, response = self.run_test(
+            "Create Job for Concurrent Bids",
+            "POST",
+            "api/jobs",
+            200,
+            data=job_data,
+            token=self.seeker_token
+        )
+        if not success or 'job_id' not in response:
+            return
+        
+        job_id = response['job_id']
+        url = f"{self.base_url}/api/jobs/{job_id}/bids"
+        headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {self.provider_token}'}
+        bid_data = {"job_id": job_id, "amount": 75000, "message": "Siap antar sekarang", "completion_time": "3 jam"}
+        
+        def place_bid(_):
+            try:
+                return requests.post(url, json=bid_data, headers=headers).status_code
+            except Exception:
+                return None
+        
+        # Every bid must reach the handler, so load shedding is switched off when the server runs in-process
+        server = sys.modules.get("server")
+        if server is not None:
+            shedding = (server.ADMISSION_CONTROL, server.RATE_LIMITING)
+            server.ADMISSION_CONTROL = server.RATE_LIMITING = False
+        
+        self.tests_run += 1
+        print(f"\n🔍 Testing {concurrency} Simultaneous Bids...")
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                status_codes = list(executor.map(place_bid, range(concurrency)))
+        finally:
+            if server is not None:
+                server.ADMISSION_CONTROL, server.RATE_LIMITING = shedding
+        
+        accepted = status_codes.count(200)
+        rejected = status_codes.count(400)
+        shed = sum(1 for code in status_codes if code in (429, 503))
+        details = requests.get(f"{self.base_url}/api/jobs/{job_id}", headers=headers).json()
+        bids_count = details.get('job', {}).get('bids_count')
+        
+        # A shed request never reached the unique index, so any shedding makes the result inconclusive
+        if accepted == 1 and rejected == concurrency - 1 and shed == 0 and bids_count == 1:
+            self.tests_passed += 1
+            print(f"✅ Passed - 1 bid accepted, {rejected} duplicates rejected, {shed} shed")
+        else:
+            print(f"❌ Failed - accepted={accepted}, rejected={rejected}, shed={shed}, bids_count={bids_count}")
+
+    def test_admission_controller(self):
+        """Test admission priorities, queue limits and timeouts directly (in-process only)"""
+        print("\n" + "="*50)
+        print("TESTING ADMISSION CONTROLLER")
+        print("="*50)
+        
+        server = sys.modules.get("server")
+        if server is None:
+            print("⚠️  Admission controller can only be tested against the in-process server")
+            return
+        
+        def controller(capacity=1, browse_share=1.0, max_queue=4, max_wait=1.0):
+            return server.AdmissionController(capacity, [
+                server.AdmissionClass("critical", 0, 1.0, max_queue, max_wait),
+                server.AdmissionClass("browse", 1, browse_share, max_queue, max_wait)
+            ])
+        
+        async def priority_handover():
+            admission = controller()
+            await admission.acquire("browse")
+            admitted = []
+            
+            async def wait_for(name):
+                if await admission.acquire(name):
+                    admitted.append(name)
+                    admission.release(name)
+            
+            # The browse request queues first, but the freed slot goes to the critical one
+            waiters = [asyncio.create_task(wait_for("browse")), asyncio.create_task(wait_for("critical"))]
+            await asyncio.sleep(0.01)
+            admission.release("browse")
+            await asyncio.gather(*waiters)
+            return admitted == ["critical", "browse"] and admission.inflight == 0, f"admitted in order {admitted}"
+        
+        async def share_limit():
+            admission = controller(capacity=2, browse_share=0.5, max_wait=0.05)
+            first, second = await admission.acquire("browse"), await admission.acquire("browse")
+            critical = await admission.acquire("critical")
+            return (first, second, critical) == (True, False, True), f"browse {first}/{second}, critical {critical}"
+        
+        async def queue_limit():
+            admission = controller(max_queue=1)
+            await admission.acquire("browse")
+            queued = asyncio.create_task(admission.acquire("browse"))
+            await asyncio.sleep(0.01)
+            started = time.monotonic()
+            shed = await admission.acquire("browse")
+            waited = time.monotonic() - started
+            admission.release("browse")
+            await queued
+            return not shed and waited < 0.05 and queued.result(), f"overflow shed after {waited:.3f}s, queued request admitted"
+        
+        async def wait_timeout():
+            admission = controller(max_wait=0.05)
+            await admission.acquire("browse")
+            admitted = await admission.acquire("browse")
+            return (
+                not admitted and admission.queued["browse"] == 0 and admission.inflight == 1,
+                f"admitted {admitted}, queued {admission.queued['browse']}, inflight {admission.inflight}"
+            )
+        
+        async def handover_race():
+            # Release lands right around the waiter's deadline; whichever way it goes, no slot may leak
+            admission = controller(max_wait=0.005)
+            loop = asyncio.get_running_loop()
+            outcomes = []
+            for attempt in range(50):
+                await admission.acquire("browse")
+                loop.call_later(0.0025 + attempt * 0.0001, admission.release, "browse")
+                admitted = await admission.acquire("browse")
+                outcomes.append(admitted)
+                if admitted:
+                    admission.release("browse")
+                else:
+                    await asyncio.sleep(0.01)
+            return admission.inflight == 0 and all(waiter[3].done() for waiter in admission._waiters), (
+                f"{outcomes.count(True)} handed over, {outcomes.count(False)} timed out, inflight {admission.inflight}"
+            )
+        
+        self.run_async_test("Critical Request Admitted Before Earlier Browse Request", priority_handover)
+        self.run_async_test("Browse Share Leaves Room for Critical Requests", share_limit)
+        self.run_async_test("Full Queue Sheds Immediately", queue_limit)
+        self.run_async_test("Queued Request Times Out", wait_timeout)
+        self.run_async_test("Slot Handover Racing the Wait Deadline", handover_race)
+
     def test_bid_selection(self):
         """Test bid selection by job creator"""
         print("\n" + "="*50)
@@ -348,6 +719,182 @@ class WOIYAMarketplaceAPITester:
                 200
             )
 
+    def test_payment_idempotency(self, concurrency=5):
+        """Test that retries sharing an Idempotency-Key charge the gateway once"""
+        print("\n" + "="*50)
+        print("TESTING PAYMENT IDEMPOTENCY")
+        print("="*50)
+        
+        if not self.test_job_id or not self.test_bid_id or not self.seeker_token:
+            print("❌ Missing required data for payment idempotency testing")
+            return
+        
+        url = f"{self.base_url}/api/payments/create"
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.seeker_token}',
+            'Idempotency-Key': f"pay-{datetime.now().strftime('%H%M%S%f')}"
+        }
+        payment_data = {
+            "job_id": self.test_job_id,
+            "bid_id": self.test_bid_id,
+            "payment_method": "ovo",
+            "amount": 350000
+        }
+        
+        # Count gateway calls when the server runs in this process
+        server = sys.modules.get("server")
+        gateway_calls = []
+        if server is not None:
+            create_payment = server.MockPaymentHandler.create_payment
+            
+            async def counting_create_payment(*args, **kwargs):
+                gateway_calls.append(args)
+                return await create_payment(*args, **kwargs)
+            
+            server.MockPaymentHandler.create_payment = staticmethod(counting_create_payment)
+        
+        def create(_):
+            try:
+                response = requests.post(url, json=payment_data, headers=headers)
+                return response.status_code, response.json().get('payment_id')
+            except Exception:
+                return None, None
+        
+        self.tests_run += 1
+        print(f"\n🔍 Testing {concurrency} Concurrent Payments With One Key...")
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(create, range(concurrency)))
+        finally:
+            if server is not None:
+                server.MockPaymentHandler.create_payment = staticmethod(create_payment)
+        
+        payment_ids = {payment_id for status, payment_id in results if status == 200}
+        statuses = [status for status, _ in results]
+        if statuses == [200] * concurrency and len(payment_ids) == 1 and (server is None or len(gateway_calls) == 1):
+            self.tests_passed += 1
+            calls = f"{len(gateway_calls)} gateway call" if server is not None else "gateway calls not observable"
+            print(f"✅ Passed - every retry got payment {payment_ids.pop()}, {calls}")
+        else:
+            print(f"❌ Failed - statuses={statuses}, payment_ids={len(payment_ids)}, gateway_calls={len(gateway_calls)}")
+        
+        # Reusing the key for a different request body is a client error
+        self.tests_run += 1
+        print("\n🔍 Testing Idempotency-Key Reused With Different Body...")
+        response = requests.post(url, json={**payment_data, "amount": 1}, headers=headers)
+        if response.status_code == 422:
+            self.tests_passed += 1
+            print("✅ Passed - Status: 422")
+        else:
+            print(f"❌ Failed - Expected 422, got {response.status_code}")
+
+    def test_idempotency_store(self):
+        """Test idempotency claim leases against the in-memory backend (in-process only)"""
+        print("\n" + "="*50)
+        print("TESTING IDEMPOTENCY STORE")
+        print("="*50)
+        
+        server = sys.modules.get("server")
+        if server is None:
+            print("⚠️  Idempotency store can only be tested against the in-process server")
+            return
+        
+        collection = server.db[f"idempotency_test_{datetime.now().strftime('%H%M%S%f')}"]
+        store = server.IdempotencyStore(collection, ttl_seconds=60, wait_seconds=0.3, cache_size=10)
+        calls = []
+        
+        async def handler():
+            calls.append(1)
+            return {"payment_id": "pay-1"}
+        
+        def claim(key, locked_until):
+            return asyncio.run(collection.insert_one({
+                "_id": key, "fingerprint": "f", "status": "in_progress", "created_at": datetime.utcnow(),
+                "owner": "crashed-worker", "locked_until": locked_until
+            }))
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Expired Claim Is Taken Over...")
+        claim("expired", datetime.utcnow() - timedelta(seconds=1))
+        response = asyncio.run(store.run("expired", "f", handler))
+        stored = asyncio.run(collection.find_one({"_id": "expired"}))
+        if response == {"payment_id": "pay-1"} and len(calls) == 1 and stored["status"] == "completed":
+            self.tests_passed += 1
+            print("✅ Passed - handler ran once and the response was stored")
+        else:
+            print(f"❌ Failed - response {response}, {len(calls)} handler calls, stored {stored}")
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Live Claim Is Not Taken Over...")
+        calls.clear()
+        claim("live", datetime.utcnow() + timedelta(seconds=60))
+        try:
+            asyncio.run(store.run("live", "f", handler))
+            status = 200
+        except server.HTTPException as e:
+            status = e.status_code
+        if status == 409 and not calls:
+            self.tests_passed += 1
+            print("✅ Passed - duplicate got 409 while the lease was held")
+        else:
+            print(f"❌ Failed - status {status}, {len(calls)} handler calls")
+
+    def test_owner_cancellation(self):
+        """Test that waiters retry shared work when its owner is cancelled (in-process only)"""
+        print("\n" + "="*50)
+        print("TESTING OWNER CANCELLATION")
+        print("="*50)
+        
+        server = sys.modules.get("server")
+        if server is None:
+            print("⚠️  Owner cancellation can only be tested against the in-process server")
+            return
+        
+        async def scenario(run):
+            # The owner is cancelled while its work is blocked; the duplicate then has to do the work itself
+            started, release, calls = asyncio.Event(), asyncio.Event(), []
+            
+            async def work():
+                calls.append(1)
+                started.set()
+                await release.wait()
+                return {"call": len(calls)}
+            
+            owner = asyncio.create_task(run(work))
+            await started.wait()
+            duplicate = asyncio.create_task(run(work))
+            await asyncio.sleep(0.01)
+            owner.cancel()
+            release.set()
+            result = await duplicate
+            return owner.cancelled(), result, len(calls)
+        
+        cache = server.SingleFlightCache("cancel_test", 60, 10)
+        collection = server.db[f"idempotency_cancel_{datetime.now().strftime('%H%M%S%f')}"]
+        store = server.IdempotencyStore(collection, ttl_seconds=60, wait_seconds=1, cache_size=10)
+        cases = [
+            ("Single-Flight Cache", lambda work: cache.get("key", work)),
+            ("Idempotency Store", lambda work: store.run("key", "f", work))
+        ]
+        for name, run in cases:
+            self.tests_run += 1
+            print(f"\n🔍 Testing {name} Waiter Retries After Owner Cancellation...")
+            try:
+                cancelled, result, calls = asyncio.run(scenario(run))
+            except Exception as e:
+                print(f"❌ Failed - waiter raised {e!r}")
+                continue
+            if cancelled and result == {"call": 2} and calls == 2:
+                self.tests_passed += 1
+                print("✅ Passed - waiter reran the work and got its result")
+            else:
+                print(f"❌ Failed - owner cancelled {cancelled}, result {result}, {calls} calls")
+        
+        stored = asyncio.run(collection.find_one({"_id": "key"}))
+        if not stored or stored["status"] != "completed":
+            print(f"   ⚠️  Retried idempotent request was not stored: {stored}")
+
     def test_wallet_functionality(self):
         """Test wallet and transaction history"""
         print("\n" + "="*50)
@@ -414,6 +961,109 @@ class WOIYAMarketplaceAPITester:
                 print(f"   Selected Bids: {response.get('selected_bids', 0)}")
                 print(f"   Total Earnings: Rp {response.get('total_earnings', 0):,}")
 
+    def test_batch_requests(self):
+        """Test composite batch endpoint for the mobile home screen"""
+        print("\n" + "="*50)
+        print("TESTING BATCH REQUESTS")
+        print("="*50)
+        
+        if not self.provider_token:
+            print("❌ No provider token available for batch test")
+            return
+        
+        batch_data = {
+            "requests": [
+                {"id": "profile", "path": "/api/user/profile"},
+                {"id": "stats", "path": "/api/dashboard/stats"},
+                {"id": "wallet", "path": "/api/wallet"},
+                {"id": "jobs", "path": "/api/jobs", "params": {"limit": 10}},
+                {"id": "invalid", "path": "/api/jobs", "params": {"category": "bogus"}}
+            ]
+        }
+        
+        success, response = self.run_test(
+            "Batch Home Screen Requests",
+            "POST",
+            "api/batch",
+            200,
+            data=batch_data,
+            token=self.provider_token
+        )
+        
+        if success and 'responses' in response:
+            for item in response['responses']:
+                print(f"   {item['id']}: {item['status']}")
+            
+            # Invalid sub-request parameters must be rendered as validation errors, like a direct GET
+            self.tests_run += 1
+            print("\n🔍 Testing Batch Sub-request Validation Error...")
+            invalid = next(item for item in response['responses'] if item['id'] == 'invalid')
+            if invalid['status'] == 422 and isinstance(invalid['body'].get('detail'), list):
+                self.tests_passed += 1
+                print("✅ Passed - Status: 422")
+            else:
+                print(f"❌ Failed - Expected 422, got {invalid['status']}")
+
+    def test_rate_limiting(self):
+        """Test token-bucket rate limiting, proxy address resolution and batch tokens (in-process only)"""
+        print("\n" + "="*50)
+        print("TESTING RATE LIMITING")
+        print("="*50)
+        
+        server = sys.modules.get("server")
+        if server is None or not self.provider_token:
+            print("⚠️  Rate limiting can only be tested against the in-process server")
+            return
+        
+        saved = (server.RATE_LIMITING, server.rate_limits, server.rate_limit_backend, server.RATE_LIMIT_TRUSTED_PROXIES)
+        server.RATE_LIMITING = True
+        server.rate_limits = server.parse_rate_limits("auth=1/60,feed=2/60,default=1000/60")
+        server.RATE_LIMIT_TRUSTED_PROXIES = 1
+        headers = {'Authorization': f'Bearer {self.provider_token}'}
+        try:
+            self.tests_run += 1
+            print("\n🔍 Testing Feed Limit Returns 429 With Retry-After...")
+            server.rate_limit_backend = server.InMemoryRateLimitBackend()
+            responses = [requests.get(f"{self.base_url}/api/jobs", headers=headers) for _ in range(3)]
+            statuses = [response.status_code for response in responses]
+            retry_after = responses[-1].headers.get('Retry-After')
+            if statuses == [200, 200, 429] and retry_after and int(retry_after) >= 1:
+                self.tests_passed += 1
+                print(f"✅ Passed - statuses {statuses}, Retry-After {retry_after}s")
+            else:
+                print(f"❌ Failed - statuses {statuses}, Retry-After {retry_after}")
+            
+            # With one trusted proxy the client is the rightmost X-Forwarded-For entry; entries to its
+            # left come from the client and must not buy a fresh bucket
+            self.tests_run += 1
+            print("\n🔍 Testing Anonymous Limit Keyed by Forwarded Client Address...")
+            server.rate_limit_backend = server.InMemoryRateLimitBackend()
+            login = {"email": "nobody@test.com", "password": "wrong"}
+            statuses = [
+                requests.post(f"{self.base_url}/api/auth/login", json=login, headers={'X-Forwarded-For': forwarded}).status_code
+                for forwarded in ("203.0.113.7", "203.0.113.7", "198.51.100.1, 203.0.113.7", "203.0.113.8")
+            ]
+            if statuses == [401, 429, 429, 401]:
+                self.tests_passed += 1
+                print(f"✅ Passed - statuses {statuses}")
+            else:
+                print(f"❌ Failed - expected [401, 429, 429, 401], got {statuses}")
+            
+            self.tests_run += 1
+            print("\n🔍 Testing Batch Sub-requests Spend Their Own Route Tokens...")
+            server.rate_limit_backend = server.InMemoryRateLimitBackend()
+            batch_data = {"requests": [{"id": str(n), "path": "/api/jobs", "params": {"limit": 1}} for n in range(3)]}
+            response = requests.post(f"{self.base_url}/api/batch", json=batch_data, headers=headers)
+            statuses = sorted(item['status'] for item in response.json().get('responses', []))
+            direct = requests.get(f"{self.base_url}/api/jobs", headers=headers).status_code
+            if response.status_code == 200 and statuses == [200, 200, 429] and direct == 429:
+                self.tests_passed += 1
+                print(f"✅ Passed - sub-requests {statuses}, direct feed request then {direct}")
+            else:
+                print(f"❌ Failed - batch {response.status_code} with {statuses}, direct feed request {direct}")
+        finally:
+            server.RATE_LIMITING, server.rate_limits, server.rate_limit_backend, server.RATE_LIMIT_TRUSTED_PROXIES = saved
+
     def test_messaging_system(self):
         """Test messaging between users"""
         print("\n" + "="*50)
@@ -424,31 +1074,253 @@ class WOIYAMarketplaceAPITester:
             print("❌ Missing user data for messaging test")
             return
         
-        # Send message from seeker to provider
-        message_data = {
-            "recipient_id": self.provider_user['id'],
-            "content": "Halo, kapan bisa mulai perbaikan AC?",
-            "job_id": self.test_job_id
-        }
+        provider_headers = {'Authorization': f'Bearer {self.provider_token}'}
+        unread_before = requests.get(f"{self.base_url}/api/inbox", headers=provider_headers).json().get('total_unread', 0)
+        
+        # Send two messages from seeker to provider
+        for content in ("Halo, kapan bisa mulai perbaikan AC?", "Saya ada di rumah setelah jam 3"):
+            message_data = {
+                "recipient_id": self.provider_user['id'],
+                "content": content,
+                "job_id": self.test_job_id
+            }
+            
+            success, response = self.run_test(
+                "Send Message (Seeker to Provider)",
+                "POST",
+                "api/messages",
+                200,
+                data=message_data,
+                token=self.seeker_token
+            )
+            if not success:
+                return
+        
+        # Get conversation
+        self.run_test(
+            "Get Conversation",
+            "GET",
+            f"api/messages/{self.provider_user['id']}",
+            200,
+            token=self.seeker_token
+        )
         
+        # Recipient's inbox should show both messages as unread
         success, response = self.run_test(
-            "Send Message (Seeker to Provider)",
+            "Get Inbox (Provider)",
+            "GET",
+            "api/inbox",
+            200,
+            token=self.provider_token
+        )
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Inbox Unread Count...")
+        if response.get('total_unread') == unread_before + 2:
+            self.tests_passed += 1
+            print(f"✅ Passed - {response['total_unread']} unread")
+        else:
+            print(f"❌ Failed - expected {unread_before + 2} unread, got {response.get('total_unread')}")
+        
+        success, response = self.run_test(
+            "Mark Conversation Read",
+            "POST",
+            f"api/messages/{self.seeker_user['id']}/read",
+            200,
+            token=self.provider_token
+        )
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Unread Count After Mark Read...")
+        inbox = requests.get(f"{self.base_url}/api/inbox", headers=provider_headers).json()
+        conversation = next(
+            (c for c in inbox.get('conversations', []) if c['partner_id'] == self.seeker_user['id']), {}
+        )
+        if response.get('marked_read', 0) >= 2 and conversation.get('unread_count') == 0:
+            self.tests_passed += 1
+            print(f"✅ Passed - marked {response['marked_read']} read, conversation unread 0")
+        else:
+            print(f"❌ Failed - marked_read={response.get('marked_read')}, unread={conversation.get('unread_count')}")
+        
+        self.test_conversation_backfill()
+
+    def test_conversation_backfill(self):
+        """Test rebuilding inbox summaries from stored messages (in-process only)"""
+        server = sys.modules.get("server")
+        if server is None:
+            return
+        
+        # One more unread message, then lose every summary as if they predated the inbox
+        self.run_test(
+            "Send Message Before Backfill",
             "POST",
             "api/messages",
             200,
-            data=message_data,
+            data={"recipient_id": self.provider_user['id'], "content": "Sudah dapat pesan saya?", "job_id": self.test_job_id},
             token=self.seeker_token
         )
+        provider_headers = {'Authorization': f'Bearer {self.provider_token}'}
+        expected = requests.get(f"{self.base_url}/api/inbox", headers=provider_headers).json()
+        asyncio.run(server.db.conversations.delete_many({}))
         
-        # Get conversation
-        if success:
-            self.run_test(
-                "Get Conversation",
-                "GET",
-                f"api/messages/{self.provider_user['id']}",
+        self.tests_run += 1
+        print("\n🔍 Testing Conversation Backfill...")
+        asyncio.run(server.backfill_conversations())
+        rebuilt = requests.get(f"{self.base_url}/api/inbox", headers=provider_headers).json()
+        summarize = lambda inbox: sorted(
+            (c['partner_id'], c['unread_count'], c['last_message']['id']) for c in inbox.get('conversations', [])
+        )
+        if rebuilt.get('total_unread') == expected.get('total_unread') and summarize(rebuilt) == summarize(expected):
+            self.tests_passed += 1
+            print(f"✅ Passed - {len(rebuilt['conversations'])} conversations, {rebuilt['total_unread']} unread")
+        else:
+            print(f"❌ Failed - expected {summarize(expected)}, rebuilt {summarize(rebuilt)}")
+
+    def test_message_write_buffer(self):
+        """Test write-behind message batching against the in-memory backend (in-process only)"""
+        print("\n" + "="*50)
+        print("TESTING MESSAGE WRITE BUFFER")
+        print("="*50)
+        
+        server = sys.modules.get("server")
+        if server is None:
+            print("⚠️  Message write buffer can only be tested against the in-process server")
+            return
+        
+        stamp = datetime.now().strftime('%H%M%S%f')
+        
+        async def flush_by_size():
+            collection = server.db[f"write_buffer_size_{stamp}"]
+            buffer = server.MessageWriteBuffer(collection, max_batch_size=3, max_delay_ms=10000)
+            started = time.monotonic()
+            await asyncio.gather(*[buffer.insert({"n": n}) for n in range(3)])
+            elapsed = time.monotonic() - started
+            stored = await collection.count_documents({})
+            return elapsed < 1 and stored == 3, f"{stored} documents stored after {elapsed:.3f}s"
+        
+        async def flush_by_timer():
+            collection = server.db[f"write_buffer_timer_{stamp}"]
+            buffer = server.MessageWriteBuffer(collection, max_batch_size=100, max_delay_ms=50)
+            started = time.monotonic()
+            await buffer.insert({"n": 0})
+            elapsed = time.monotonic() - started
+            stored = await collection.count_documents({})
+            return 0.04 <= elapsed < 1 and stored == 1, f"lone insert acknowledged after {elapsed:.3f}s"
+        
+        async def per_document_errors():
+            # The duplicate _id fails on its own; the rest of its batch is still written and acknowledged
+            collection = server.db[f"write_buffer_errors_{stamp}"]
+            buffer = server.MessageWriteBuffer(collection, max_batch_size=3, max_delay_ms=10000)
+            results = await asyncio.gather(
+                *[buffer.insert({"_id": key}) for key in ("a", "a", "b")], return_exceptions=True
+            )
+            outcomes = ["error" if isinstance(result, Exception) else "ok" for result in results]
+            stored = await collection.count_documents({})
+            return outcomes == ["ok", "error", "ok"] and stored == 2, f"outcomes {outcomes}, {stored} documents stored"
+        
+        async def close_flushes_pending():
+            collection = server.db[f"write_buffer_close_{stamp}"]
+            buffer = server.MessageWriteBuffer(collection, max_batch_size=100, max_delay_ms=10000)
+            pending = asyncio.create_task(buffer.insert({"n": 0}))
+            await asyncio.sleep(0)
+            await buffer.close()
+            await asyncio.wait_for(pending, 1)
+            stored = await collection.count_documents({})
+            return stored == 1, f"{stored} pending document written on close"
+        
+        self.run_async_test("Batch Flushed When Full", flush_by_size)
+        self.run_async_test("Batch Flushed by Timer", flush_by_timer)
+        self.run_async_test("Per-document Insert Errors", per_document_errors)
+        self.run_async_test("Close Flushes Pending Writes", close_flushes_pending)
+
+    def test_message_buckets(self):
+        """Test bucketed message storage, its migration and time windows (in-process only)"""
+        print("\n" + "="*50)
+        print("TESTING MESSAGE BUCKETS")
+        print("="*50)
+        
+        server = sys.modules.get("server")
+        if server is None or not self.seeker_user or not self.provider_user:
+            print("⚠️  Bucket storage can only be switched on the in-process server")
+            return
+        
+        bucket_size = server.MESSAGE_BUCKET_SIZE
+        server.MESSAGE_BUCKET_SIZE = 2
+        try:
+            # Migrating twice must leave the same buckets behind, as a re-run after a failure would
+            self.tests_run += 1
+            print("\n🔍 Testing Resumable Bucket Migration...")
+            stored = asyncio.run(server.db.messages.count_documents({}))
+            first = asyncio.run(server.migrate_messages_to_buckets())
+            buckets_after_first = asyncio.run(server.db.message_buckets.count_documents({}))
+            second = asyncio.run(server.migrate_messages_to_buckets())
+            buckets_after_second = asyncio.run(server.db.message_buckets.count_documents({}))
+            if first == second and first['messages_migrated'] == stored and buckets_after_first == buckets_after_second:
+                self.tests_passed += 1
+                print(f"✅ Passed - {stored} messages in {buckets_after_second} buckets, re-run changed nothing")
+            else:
+                print(f"❌ Failed - first={first}, second={second}, buckets {buckets_after_first} -> {buckets_after_second}")
+            
+            server.MESSAGE_STORAGE = "buckets"
+            provider_headers = {'Authorization': f'Bearer {self.provider_token}'}
+            conversation_url = f"{self.base_url}/api/messages/{self.seeker_user['id']}"
+            before = requests.get(conversation_url, headers=provider_headers).json().get('messages', [])
+            unread_before = sum(1 for m in before if m['sender_id'] == self.seeker_user['id'] and not m['is_read'])
+            
+            sent_ids = []
+            for number in range(5):
+                success, response = self.run_test(
+                    f"Send Bucketed Message {number + 1}",
+                    "POST",
+                    "api/messages",
+                    200,
+                    data={"recipient_id": self.provider_user['id'], "content": f"Pesan {number + 1}", "job_id": self.test_job_id},
+                    token=self.seeker_token
+                )
+                if success:
+                    sent_ids.append(response['message_id'])
+            
+            messages = requests.get(conversation_url, headers=provider_headers).json().get('messages', [])
+            self.tests_run += 1
+            print("\n🔍 Testing Bucketed Conversation Order...")
+            if [m['id'] for m in messages] == [m['id'] for m in before] + sent_ids:
+                self.tests_passed += 1
+                print(f"✅ Passed - {len(messages)} messages in order across buckets")
+            else:
+                print("❌ Failed - bucketed conversation is missing or reordering messages")
+            
+            # since/until select messages 2-4 of the new ones, including both boundaries
+            window = [m for m in messages if m['id'] in sent_ids[1:4]]
+            self.tests_run += 1
+            print("\n🔍 Testing Conversation Time Window...")
+            windowed = requests.get(
+                conversation_url,
+                params={"since": window[0]['created_at'], "until": window[-1]['created_at']},
+                headers=provider_headers
+            ).json().get('messages', [])
+            if [m['id'] for m in windowed] == [m['id'] for m in window]:
+                self.tests_passed += 1
+                print(f"✅ Passed - {len(windowed)} messages inside the window")
+            else:
+                print(f"❌ Failed - expected {len(window)} messages, got {len(windowed)}")
+            
+            success, response = self.run_test(
+                "Mark Bucketed Conversation Read",
+                "POST",
+                f"api/messages/{self.seeker_user['id']}/read",
                 200,
-                token=self.seeker_token
+                token=self.provider_token
             )
+            self.tests_run += 1
+            print("\n🔍 Testing Bucketed Mark Read Counts Messages...")
+            if response.get('marked_read') == unread_before + len(sent_ids):
+                self.tests_passed += 1
+                print(f"✅ Passed - {response['marked_read']} messages marked read")
+            else:
+                print(f"❌ Failed - expected {unread_before + len(sent_ids)}, got {response.get('marked_read')}")
+        finally:
+            server.MESSAGE_STORAGE = "documents"
+            server.MESSAGE_BUCKET_SIZE = bucket_size
 
     def test_rating_system(self):
         """Test rating system"""
@@ -476,6 +1348,397 @@ class WOIYAMarketplaceAPITester:
             token=self.seeker_token
         )
 
+    def test_leaderboard(self):
+        """Test provider leaderboard for the rated job's category"""
+        print("\n" + "="*50)
+        print("TESTING PROVIDER LEADERBOARD")
+        print("="*50)
+        
+        if not self.seeker_token:
+            print("❌ No seeker token available for leaderboard test")
+            return
+        
+        success, response = self.run_test(
+            "Get Home Repair Leaderboard",
+            "GET",
+            "api/leaderboards/perbaikan_rumah",
+            200,
+            token=self.seeker_token
+        )
+        
+        if success and 'entries' in response:
+            print(f"   Found {len(response['entries'])} ranked providers")
+        
+        server = sys.modules.get("server")
+        if server is None or not success or not self.test_job_id or not self.provider_token:
+            return
+        
+        # A provider rating themselves on a job they bid on must not move the leaderboard
+        self.run_test(
+            "Submit Self-Rating", "POST", "api/ratings", 200,
+            data={"target_user_id": self.provider_user['id'], "job_id": self.test_job_id, "rating": 1, "comment": "Saya sendiri"},
+            token=self.provider_token
+        )
+        time.sleep(0.5)  # Leaderboard updates run as background tasks after the response
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Self-Rating Leaves Leaderboard Unchanged...")
+        headers = {'Authorization': f'Bearer {self.seeker_token}'}
+        after = requests.get(f"{self.base_url}/api/leaderboards/perbaikan_rumah", headers=headers).json()
+        if after['entries'] == response['entries']:
+            self.tests_passed += 1
+            print("✅ Passed - leaderboard unchanged")
+        else:
+            print(f"❌ Failed - before {response['entries']}, after {after['entries']}")
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Leaderboard Rebuild Matches Live Scores...")
+        asyncio.run(server.rebuild_leaderboards())
+        rebuilt = requests.get(f"{self.base_url}/api/leaderboards/perbaikan_rumah", headers=headers).json()
+        if rebuilt['entries'] == response['entries']:
+            self.tests_passed += 1
+            print(f"✅ Passed - {len(rebuilt['entries'])} ranked providers after rebuild")
+        else:
+            print(f"❌ Failed - live {response['entries']}, rebuilt {rebuilt['entries']}")
+
+    def test_price_guidance(self):
+        """Test bid price guidance for the bid-on job's category"""
+        print("\n" + "="*50)
+        print("TESTING BID PRICE GUIDANCE")
+        print("="*50)
+        
+        if not self.provider_token:
+            print("❌ No provider token available for price guidance test")
+            return
+        
+        success, response = self.run_test(
+            "Get Home Repair Price Guidance",
+            "GET",
+            "api/price-guidance/perbaikan_rumah",
+            200,
+            token=self.provider_token
+        )
+        
+        if success and response.get('bids'):
+            print(f"   Median bid: {response['bids']['p50']}, typical winning amount: {response['typical_winning_amount']}")
+        
+        server = sys.modules.get("server")
+        if server is None:
+            return
+        
+        def snapshot():
+            sketches = asyncio.run(server.db.bid_price_sketches.find({}, {"_id": 0, "updated_at": 0}).to_list(length=None))
+            return {(sketch["category"], sketch["area"], sketch["kind"]): sketch for sketch in sketches}
+        
+        live = snapshot()
+        asyncio.run(server.db.bid_price_sketches.insert_one(
+            {"category": "asisten_harian", "area": "0.0:0.0", "kind": "bids", "count": 1, "buckets": {"100": 1}, "updated_at": datetime(2000, 1, 1)}
+        ))
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Price Sketch Rebuild Matches Live Sketches...")
+        rebuilt_count = asyncio.run(server.rebuild_bid_price_sketches())
+        rebuilt = snapshot()
+        if rebuilt == live and rebuilt_count == len(live):
+            self.tests_passed += 1
+            print(f"✅ Passed - {rebuilt_count} sketches rebuilt, stale sketch removed")
+        else:
+            print(f"❌ Failed - {rebuilt_count} sketches rebuilt")
+            for key in sorted(set(live) | set(rebuilt)):
+                if live.get(key) != rebuilt.get(key):
+                    print(f"   {key}: live {live.get(key)}, rebuilt {rebuilt.get(key)}")
+
+    def test_read_routing(self):
+        """Test which reads may be served by a lagging secondary (in-process only)"""
+        print("\n" + "="*50)
+        print("TESTING READ ROUTING")
+        print("="*50)
+        
+        server = sys.modules.get("server")
+        if server is None or not self.seeker_token or not self.provider_token:
+            print("⚠️  Read routing can only be checked against the in-process server")
+            return
+        
+        # An empty database stands in for a secondary that has not replicated anything yet
+        from memory_store import InMemoryDatabase
+        configured_secondary_db = server.secondary_db
+        server.secondary_db = InMemoryDatabase("lagging_secondary")
+        try:
+            job_data = {
+                "title": "Antar Dokumen",
+                "description": "Antar dokumen ke kantor notaris hari ini",
+                "category": "courier_logistik",
+                "budget_min": 50000,
+                "budget_max": 100000,
+                "location": {"lat": -6.2088, "lng": 106.8456},
+                "address": "Jl. Thamrin No. 1, Jakarta Pusat",
+                "deadline": (datetime.now() + timedelta(days=2)).isoformat(),
+                "requirements": []
+            }
+            success, response = self.run_test(
+                "Create Job for Read Routing", "POST", "api/jobs", 200, data=job_data, token=self.seeker_token
+            )
+            if not success or 'job_id' not in response:
+                return
+            job_id = response['job_id']
+            
+            # Reads that must see the caller's own writes stay on the primary
+            for name, endpoint, token in (
+                ("Seeker Job List", "api/jobs", self.seeker_token),
+                ("Job Details", f"api/jobs/{job_id}", self.provider_token)
+            ):
+                self.tests_run += 1
+                print(f"\n🔍 Testing {name} Reads Primary...")
+                body = requests.get(
+                    f"{self.base_url}/{endpoint}", headers={'Authorization': f'Bearer {token}'}
+                ).json()
+                job_ids = [job['id'] for job in body.get('jobs', [body.get('job', {})])]
+                if job_id in job_ids:
+                    self.tests_passed += 1
+                    print("✅ Passed - new job visible")
+                else:
+                    print("❌ Failed - new job missing, read was routed to the secondary")
+            
+            # Seeker facets must count the same own jobs the primary lists
+            self.tests_run += 1
+            print("\n🔍 Testing Seeker Job Facets Read Primary...")
+            headers = {'Authorization': f'Bearer {self.seeker_token}'}
+            listed = requests.get(
+                f"{self.base_url}/api/jobs?category=courier_logistik&status=open&limit=100", headers=headers
+            ).json().get('jobs', [])
+            facets = requests.get(
+                f"{self.base_url}/api/jobs/facets?category=courier_logistik&status=open", headers=headers
+            ).json()
+            if listed and facets.get('total') == len(listed):
+                self.tests_passed += 1
+                print(f"✅ Passed - facets count {facets['total']} open courier jobs")
+            else:
+                print(f"❌ Failed - facets total {facets.get('total')}, primary lists {len(listed)}")
+            
+            # The provider feed tolerates staleness and is served by the secondary
+            self.tests_run += 1
+            print("\n🔍 Testing Provider Feed Reads Secondary...")
+            body = requests.get(
+                f"{self.base_url}/api/jobs", headers={'Authorization': f'Bearer {self.provider_token}'}
+            ).json()
+            if body.get('jobs') == []:
+                self.tests_passed += 1
+                print("✅ Passed - feed served by the lagging secondary")
+            else:
+                print(f"❌ Failed - feed returned {len(body.get('jobs', []))} jobs from the primary")
+        finally:
+            server.secondary_db = configured_secondary_db
+
+    def test_archival(self):
+        """Test that archived jobs stay reachable through the history endpoints (in-process only)"""
+        print("\n" + "="*50)
+        print("TESTING ARCHIVAL")
+        print("="*50)
+        
+        server = sys.modules.get("server")
+        if server is None or not self.seeker_token or not self.provider_token:
+            print("⚠️  Archival can only be run against the in-process server")
+            return
+        
+        # Take a job through to completion: bid, selection, payment, escrow release
+        job_data = {
+            "title": "Bersih Taman",
+            "description": "Membersihkan taman belakang rumah",
+            "category": "asisten_harian",
+            "budget_min": 100000,
+            "budget_max": 200000,
+            "location": {"lat": -6.2088, "lng": 106.8456},
+            "address": "Jl. Kemang No. 5, Jakarta Selatan",
+            "deadline": (datetime.now() + timedelta(days=3)).isoformat(),
+            "requirements": []
+        }
+        success, response = self.run_test(
+            "Create Job for Archival", "POST", "api/jobs", 200, data=job_data, token=self.seeker_token
+        )
+        if not success:
+            return
+        job_id = response['job_id']
+        success, response = self.run_test(
+            "Bid on Job for Archival", "POST", f"api/jobs/{job_id}/bids", 200,
+            data={"job_id": job_id, "amount": 150000, "message": "Siap", "completion_time": "1 hari"},
+            token=self.provider_token
+        )
+        if not success:
+            return
+        bid_id = response['bid_id']
+        self.run_test("Select Bid for Archival", "POST", f"api/jobs/{job_id}/select-bid/{bid_id}", 200, token=self.seeker_token)
+        success, response = self.run_test(
+            "Pay for Archival Job", "POST", "api/payments/create", 200,
+            data={"job_id": job_id, "bid_id": bid_id, "payment_method": "virtual_account", "amount": 150000},
+            token=self.seeker_token
+        )
+        if not success:
+            return
+        payment_id = response['payment_id']
+        self.run_test("Confirm Archival Payment", "POST", f"api/payments/{payment_id}/confirm", 200)
+        self.run_test("Release Archival Payment", "POST", f"api/payments/{payment_id}/release", 200, token=self.seeker_token)
+        
+        provider_headers = {'Authorization': f'Bearer {self.provider_token}'}
+        stats_before = requests.get(f"{self.base_url}/api/dashboard/stats", headers=provider_headers).json()
+        
+        # Every completed job is old enough with a zero-day cutoff
+        self.tests_run += 1
+        print("\n🔍 Testing Archive Closed Jobs...")
+        report = asyncio.run(server.archive_closed_jobs(older_than_days=0))
+        live_job = asyncio.run(server.db.jobs.find_one({"id": job_id}))
+        if live_job is None and report['moved']['jobs'] >= 1 and report['moved']['payments'] >= 1:
+            self.tests_passed += 1
+            print(f"✅ Passed - moved {report['moved']}")
+        else:
+            print(f"❌ Failed - job not archived, report {report}")
+            return
+        
+        success, response = self.run_test(
+            "Get Archived Job Details", "GET", f"api/jobs/{job_id}", 200, token=self.provider_token
+        )
+        if success and response.get('job', {}).get('status') != 'completed':
+            print("   ⚠️  Archived job details did not come back completed")
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Wallet History Includes Archived Payment...")
+        wallet = requests.get(f"{self.base_url}/api/wallet", headers=provider_headers).json()
+        if payment_id in [payment['id'] for payment in wallet.get('recent_transactions', [])]:
+            self.tests_passed += 1
+            print("✅ Passed - archived payment listed")
+        else:
+            print("❌ Failed - archived payment missing from wallet history")
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Dashboard Totals Unchanged by Archival...")
+        stats_after = requests.get(f"{self.base_url}/api/dashboard/stats", headers=provider_headers).json()
+        if stats_after == stats_before:
+            self.tests_passed += 1
+            print(f"✅ Passed - earnings Rp {stats_after.get('total_earnings', 0):,}")
+        else:
+            print(f"❌ Failed - before {stats_before}, after {stats_after}")
+        
+        self.run_test(
+            "Rate Archived Job", "POST", "api/ratings", 200,
+            data={"target_user_id": self.provider_user['id'], "job_id": job_id, "rating": 4, "comment": "Rapi"},
+            token=self.seeker_token
+        )
+
+    def test_admin_export(self):
+        """Test admin grants and the NDJSON/CSV exports with date filters (in-process only)"""
+        print("\n" + "="*50)
+        print("TESTING ADMIN EXPORT")
+        print("="*50)
+        
+        server = sys.modules.get("server")
+        if server is None or not self.seeker_token:
+            print("⚠️  Admin export can only be run against the in-process server")
+            return
+        
+        self.run_test("Export Without Admin", "GET", "api/admin/export/jobs", 403, token=self.seeker_token)
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Grant Admin...")
+        granted = asyncio.run(server.set_admin(self.seeker_user['email']))
+        missing = asyncio.run(server.set_admin("nobody@test.com"))
+        if granted and not missing:
+            self.tests_passed += 1
+            print("✅ Passed - admin granted, unknown email rejected")
+        else:
+            print(f"❌ Failed - granted {granted}, unknown email matched {missing}")
+            return
+        
+        headers = {'Authorization': f'Bearer {self.seeker_token}'}
+        try:
+            fields = server.EXPORT_FIELDS["jobs"]
+            total = asyncio.run(server.db.jobs.count_documents({}))
+            
+            self.tests_run += 1
+            print("\n🔍 Testing NDJSON Export...")
+            response = requests.get(f"{self.base_url}/api/admin/export/jobs", params={"format": "ndjson"}, headers=headers)
+            rows = [json.loads(line) for line in response.text.splitlines() if line]
+            if response.status_code == 200 and len(rows) == total and all(list(row) == fields for row in rows):
+                self.tests_passed += 1
+                print(f"✅ Passed - {len(rows)} jobs exported")
+            else:
+                print(f"❌ Failed - status {response.status_code}, {len(rows)} rows for {total} jobs")
+                return
+            
+            self.tests_run += 1
+            print("\n🔍 Testing CSV Export...")
+            response = requests.get(f"{self.base_url}/api/admin/export/jobs", params={"format": "csv"}, headers=headers)
+            table = list(csv.reader(io.StringIO(response.text)))
+            ids = [row[fields.index("id")] for row in table[1:]]
+            if response.status_code == 200 and table and table[0] == fields and ids == [row["id"] for row in rows]:
+                self.tests_passed += 1
+                print(f"✅ Passed - header and {len(ids)} rows match the NDJSON export")
+            else:
+                print(f"❌ Failed - status {response.status_code}, header {table[:1]}, {len(ids)} rows")
+            
+            # Rows come back oldest first, so a window around the middle row excludes both ends
+            self.tests_run += 1
+            print("\n🔍 Testing Export Date Filters...")
+            created = sorted({row["created_at"] for row in rows})
+            if len(created) < 3:
+                print(f"❌ Failed - need at least three distinct created_at values, got {len(created)}")
+                return
+            start, end = created[1], created[-1]
+            response = requests.get(
+                f"{self.base_url}/api/admin/export/jobs",
+                params={"format": "ndjson", "start": start, "end": end}, headers=headers
+            )
+            window = [json.loads(line) for line in response.text.splitlines() if line]
+            expected = [row["id"] for row in rows if start <= row["created_at"] < end]
+            if response.status_code == 200 and [row["id"] for row in window] == expected and len(expected) < len(rows):
+                self.tests_passed += 1
+                print(f"✅ Passed - {len(window)} of {len(rows)} jobs in [{start}, {end})")
+            else:
+                print(f"❌ Failed - status {response.status_code}, {len(window)} rows, expected {len(expected)}")
+        finally:
+            asyncio.run(server.set_admin(self.seeker_user['email'], False))
+        
+        self.run_test("Export After Revoke", "GET", "api/admin/export/jobs", 403, token=self.seeker_token)
+
+    def test_rollup_backfill(self):
+        """Test that rebuilding the daily rollups reproduces the live counters (in-process only)"""
+        print("\n" + "="*50)
+        print("TESTING ROLLUP BACKFILL")
+        print("="*50)
+        
+        server = sys.modules.get("server")
+        if server is None:
+            print("⚠️  Rollup backfill can only be run against the in-process server")
+            return
+        
+        def snapshot():
+            rollups = asyncio.run(server.db.marketplace_rollups.find({}, {"_id": 0, "updated_at": 0}).to_list(length=None))
+            return {
+                # Stored datetimes keep milliseconds only, so recomputed durations can drift below that
+                (rollup["day"], rollup["category"]): {field: round(rollup.get(field, 0), 1) for field in server.ROLLUP_FIELDS}
+                for rollup in rollups
+            }
+        
+        live = snapshot()
+        asyncio.run(server.db.marketplace_rollups.insert_one(
+            {"day": "2000-01-01", "category": "asisten_harian", "jobs_posted": 5, "updated_at": datetime(2000, 1, 1)}
+        ))
+        # Stands in for a live $inc that lands while the rebuild is running; it must survive the cleanup
+        concurrent = {"day": "2999-01-01", "category": "asisten_harian", "jobs_posted": 1}
+        asyncio.run(server.db.marketplace_rollups.insert_one({**concurrent, "updated_at": datetime.utcnow() + timedelta(days=1)}))
+        
+        self.tests_run += 1
+        print("\n🔍 Testing Rollup Backfill Matches Live Counters...")
+        rebuilt_count = asyncio.run(server.backfill_rollups())
+        rebuilt = snapshot()
+        survivor = rebuilt.pop(("2999-01-01", "asisten_harian"), None)
+        if rebuilt == live and rebuilt_count == len(live) and survivor and survivor["jobs_posted"] == 1:
+            self.tests_passed += 1
+            print(f"✅ Passed - {rebuilt_count} buckets rebuilt, stale bucket removed, concurrent bucket kept")
+        else:
+            print(f"❌ Failed - {rebuilt_count} buckets rebuilt, concurrent bucket {survivor}")
+            for key in sorted(set(live) | set(rebuilt)):
+                if live.get(key) != rebuilt.get(key):
+                    print(f"   {key}: live {live.get(key)}, rebuilt {rebuilt.get(key)}")
+
     def run_all_tests(self):
         """Run all API tests in sequence"""
         print("🚀 Starting WOIYA Marketplace API Tests")
@@ -489,21 +1752,39 @@ class WOIYAMarketplaceAPITester:
             
             # Job management tests
             self.test_job_creation()
+            self.test_bulk_job_upload()
             self.test_job_listing()
+            self.test_job_expiry()
+            self.test_job_facets()
             self.test_job_details()
             
             # Bidding workflow tests
             self.test_bidding_system()
+            self.test_concurrent_bidding()
+            self.test_admission_controller()
             self.test_bid_selection()
             
             # Payment system tests
             self.test_payment_system()
+            self.test_payment_idempotency()
+            self.test_idempotency_store()
+            self.test_owner_cancellation()
             
             # Additional features
             self.test_wallet_functionality()
             self.test_dashboard_stats()
+            self.test_batch_requests()
+            self.test_rate_limiting()
             self.test_messaging_system()
+            self.test_message_write_buffer()
+            self.test_message_buckets()
             self.test_rating_system()
+            self.test_leaderboard()
+            self.test_price_guidance()
+            self.test_read_routing()
+            self.test_archival()
+            self.test_admin_export()
+            self.test_rollup_backfill()
             
         except Exception as e:
             print(f"\n❌ Test suite failed with error: {str(e)}")
@@ -524,8 +1805,38 @@ class WOIYAMarketplaceAPITester:
             print(f"\n⚠️  {self.tests_run - self.tests_passed} test(s) failed. Please check the issues above.")
             return 1
 
+def start_in_process_server():
+    """Serve the backend from this process on the in-memory storage backend"""
+    os.environ["STORAGE_BACKEND"] = "memory"
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+    import uvicorn
+    import server
+    
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    
+    uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=uvicorn_server.run, daemon=True).start()
+    while not uvicorn_server.started:
+        time.sleep(0.05)
+    
+    base_url = f"http://127.0.0.1:{port}"
+    # The login tests expect these fixture accounts to exist already
+    for role, email in (("pencari_jasa", "seeker@test.com"), ("penyedia_jasa", "provider@test.com")):
+        requests.post(f"{base_url}/api/auth/register", json={
+            "email": email, "password": "test123", "full_name": "Fixture User", "phone": "081200000000", "role": role
+        })
+    return base_url
+
 def main():
-    tester = WOIYAMarketplaceAPITester()
+    # python backend_test.py [--in-process | BASE_URL]
+    if "--in-process" in sys.argv:
+        tester = WOIYAMarketplaceAPITester(start_in_process_server())
+    elif len(sys.argv) > 1:
+        tester = WOIYAMarketplaceAPITester(sys.argv[1].rstrip("/"))
+    else:
+        tester = WOIYAMarketplaceAPITester()
     return tester.run_all_tests()
 
 if __name__ == "__main__":